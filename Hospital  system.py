@@ -1,7 +1,106 @@
-from datetime import datetime
+import asyncio
+import bisect
+import cProfile
+import csv
+import functools
+import heapq
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import operator
+import os
+import pstats
+import re
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
+
+SLOT_MINUTES = 15  # Resolution of doctors' schedules in minutes
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES  # Number of schedule slots in one day
+ANALYTICS_SHARD_ROWS = 1 << 18  # Rows per block of an analytics table
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5)  # Upper bounds in seconds of the operation latency histogram buckets
+INSTRUMENTED_OPERATIONS = (  # HospitalSystem methods timed when instrumentation is enabled
+    "add_patient", "add_doctor", "add_schedule", "import_patients", "export_patients", "schedule_appointment",
+    "book_appointment", "find_earliest_slot", "display_calling_queue", "remove_patient_from_queue", "add_to_queue",
+    "call_next_patient", "update_risk_level", "display_patient_info", "update_patient_info", "record_vital_sign",
+    "vital_sign_summary", "purchase_prescription", "dispense_prescriptions", "add_medication", "restock_medication",
+    "search_patient", "search_doctor", "find_patients", "search_patients", "census_report", "find_doctors",
+    "display_doctor_schedule", "display_doctor_info", "display_arrival_queue", "queue_statistics", "checkpoint",
+)
+PATIENT_FIELDS = ("id", "name", "age", "gender", "address", "phone_number", "email", "medical_condition", "risk_level",
+                  "height", "weight", "allergies", "previous_surgeries", "vital_signs")  # Columns for import/export
+
+
+EMPTY = ()  # Shared empty sentinel stored for list-like patient attributes that were never set
+EMPTY_MAPPING = MappingProxyType({})  # Shared read-only empty sentinel stored for vital signs
+HEIGHT_UNITS = {"cm": 1.0, "m": 100.0, "in": 2.54, "ft": 30.48}  # Conversion factors to centimetres
+WEIGHT_UNITS = {"kg": 1.0, "g": 0.001, "lb": 0.45359237, "lbs": 0.45359237}  # Conversion factors to kilograms
+MEASUREMENT_PATTERN = re.compile(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*$")
+
+
+def parse_measurement(value, units):
+    # Function to convert a measurement such as "180 cm" or 75 into a number in the first unit of units (or None)
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = MEASUREMENT_PATTERN.match(value)
+    unit = match.group(2).lower() if match else None
+    if unit == "":
+        unit = next(iter(units))  # A bare number is in the default unit
+    if unit not in units:
+        raise ValueError(f"Cannot parse measurement: {value!r}")
+    return float(match.group(1)) * units[unit]
+
+
+def measurement_error(height=None, weight=None):
+    # Function to check that a height and weight can be stored; returns an error message or None if both are valid
+    for name, value, units, example in (("height", height, HEIGHT_UNITS, "180 cm"),
+                                        ("weight", weight, WEIGHT_UNITS, "75 kg")):
+        try:
+            parse_measurement(value, units)
+        except (TypeError, ValueError):
+            return f"{name} {value!r} is not a measurement such as {example!r}"
+    return None
+
+
+def format_measurement(number, unit):
+    # Function to convert a stored number back into a string such as "180 cm" (or None)
+    return None if number is None or math.isnan(number) else f"{round(number, 2):g} {unit}"
+
+
+def _sparse_attribute(name, factory):
+    # Helper function to build a Patient property for a usually empty container: a shared sentinel is stored until the
+    # attribute is first read, which replaces it with a container of the patient's own that can be changed in place
+    slot = "_" + name
+    empty = EMPTY_MAPPING if factory is dict else EMPTY
+
+    def get(patient):
+        value = getattr(patient, slot)
+        if value is empty:
+            value = factory()
+            setattr(patient, slot, value)
+        return value
+
+    def set(patient, value):
+        setattr(patient, slot, value if value else empty)
+    return property(get, set)
 
 
 class Patient:  # Defining a class for Patient
+    __slots__ = ("id", "name", "age", "gender", "address", "phone_number", "email", "medical_condition", "risk_level",
+                 "height_cm", "weight_kg", "_allergies", "_previous_surgeries", "_vital_signs", "_prescriptions")
+
     def __init__(self, id, name, age, gender, address, phone_number, email, medical_condition, risk_level, height=None,
                  weight=None, allergies=None, previous_surgeries=None, vital_signs=None):
         # Initializing the Patient class with various attributes
@@ -14,12 +113,33 @@ class Patient:  # Defining a class for Patient
         self.email = email  # Patient email
         self.medical_condition = medical_condition  # Patient's current medical condition
         self.risk_level = risk_level  # Patient's risk level
-        self.height = height  # Patient's height (optional)
-        self.weight = weight  # Patient's weight (optional)
-        self.allergies = allergies if allergies else []  # Patient's allergies (default empty list)
-        self.previous_surgeries = previous_surgeries if previous_surgeries else []  # Previous surgeries (default empty list)
-        self.vital_signs = vital_signs if vital_signs else {}  # Patient's vital signs (default empty dictionary)
-        self.prescriptions = []  # List to store patient's prescriptions
+        self.height = height  # Patient's height (optional, stored in cm)
+        self.weight = weight  # Patient's weight (optional, stored in kg)
+        self.allergies = allergies  # Patient's allergies (a list is only created when needed)
+        self.previous_surgeries = previous_surgeries  # Patient's previous surgeries
+        self.vital_signs = vital_signs  # Patient's vital signs
+        self.prescriptions = None  # Patient's prescriptions
+
+    allergies = _sparse_attribute("allergies", list)
+    previous_surgeries = _sparse_attribute("previous_surgeries", list)
+    vital_signs = _sparse_attribute("vital_signs", dict)
+    prescriptions = _sparse_attribute("prescriptions", list)
+
+    @property
+    def height(self):
+        return format_measurement(self.height_cm, "cm")  # Height as a string such as "180 cm"
+
+    @height.setter
+    def height(self, value):
+        self.height_cm = parse_measurement(value, HEIGHT_UNITS)
+
+    @property
+    def weight(self):
+        return format_measurement(self.weight_kg, "kg")  # Weight as a string such as "75 kg"
+
+    @weight.setter
+    def weight(self, value):
+        self.weight_kg = parse_measurement(value, WEIGHT_UNITS)
 
     def add_vital_sign(self, key, value):
         # Method to add a vital sign for the patient
@@ -29,12 +149,253 @@ class Patient:  # Defining a class for Patient
         # Method to add a prescription for the patient
         self.prescriptions.append(prescription)  # Appending a new prescription to the patient's prescription list
 
+    def stored(self, name):
+        # Method to read allergies, previous_surgeries, vital_signs or prescriptions without creating a container
+        # for an empty one (for bulk readers such as exports and reports)
+        return getattr(self, "_" + name)
+
     def __lt__(self, other):
         # Special method for comparison (<) between Patient objects based on their ID
         return self.id < other.id  # Comparing patients based on their ID
 
 
+class PatientTable:  # Defining a class for array-backed (columnar) storage of many patients
+    def __init__(self):
+        # Initializing the PatientTable with one column per attribute
+        self.rows = 0  # Number of stored patients
+        self.ids = []  # String columns
+        self.names = []
+        self.addresses = []
+        self.phone_numbers = []
+        self.emails = []
+        self.ages = array("H")  # Numeric columns in typed arrays
+        self.risk_levels = array("b")
+        self.heights_cm = array("f")  # NaN marks a missing value
+        self.weights_kg = array("f")
+        self.genders = array("B")  # Codes into the string pool
+        self.conditions = array("I")
+        self.pool = []  # Interned strings (gender and medical condition)
+        self.pool_codes = {}  # String -> code in the pool
+        self.extras = {}  # Row -> {attribute: value} for the rarely set allergies, surgeries, vitals, prescriptions
+
+    def intern(self, value):
+        # Method to get the pool code of a string, adding it on first use
+        code = self.pool_codes.get(value)
+        if code is None:
+            code = self.pool_codes[value] = len(self.pool)
+            self.pool.append(value)
+        return code
+
+    def append(self, id, name, age, gender, address, phone_number, email, medical_condition, risk_level, height=None,
+               weight=None, allergies=None, previous_surgeries=None, vital_signs=None):
+        # Method to add a patient row; returns a Patient-compatible view of it
+        # All columns grow together or not at all: a value a typed column cannot hold (such as a negative age) would
+        # otherwise leave the earlier columns one row longer and shift every later patient's data
+        row = self.rows
+        height_cm = parse_measurement(height, HEIGHT_UNITS)
+        weight_kg = parse_measurement(weight, WEIGHT_UNITS)
+        columns = (self.ages, self.risk_levels, self.heights_cm, self.weights_kg, self.genders, self.conditions,
+                   self.ids, self.names, self.addresses, self.phone_numbers, self.emails)
+        try:
+            for column, value in zip(columns, (age, risk_level, math.nan if height_cm is None else height_cm,
+                                               math.nan if weight_kg is None else weight_kg, self.intern(gender),
+                                               self.intern(medical_condition), id, name, address, phone_number,
+                                               email)):
+                column.append(value)
+        except (TypeError, ValueError, OverflowError):
+            for column in columns:
+                del column[row:]
+            raise
+        self.rows += 1
+        view = PatientView(self, row)
+        for name, value in (("allergies", allergies), ("previous_surgeries", previous_surgeries),
+                            ("vital_signs", vital_signs)):
+            if value:
+                self.extras.setdefault(row, {})[name] = value
+        return view
+
+    def __len__(self):
+        return self.rows  # Number of stored patients
+
+
+def _column(name):
+    # Helper function to build a view property that reads and writes a plain column
+    def get(view):
+        return getattr(view.table, name)[view.row]
+
+    def set(view, value):
+        getattr(view.table, name)[view.row] = value
+    return property(get, set)
+
+
+def _pooled_column(name):
+    # Helper function to build a view property for a column of interned string codes
+    def get(view):
+        return view.table.pool[getattr(view.table, name)[view.row]]
+
+    def set(view, value):
+        getattr(view.table, name)[view.row] = view.table.intern(value)
+    return property(get, set)
+
+
+def _measurement_column(name, units, unit):
+    # Helper function to build a view property for a float column shown as a measurement string
+    def get(view):
+        return format_measurement(getattr(view.table, name)[view.row], unit)
+
+    def set(view, value):
+        number = parse_measurement(value, units)
+        getattr(view.table, name)[view.row] = math.nan if number is None else number
+    return property(get, set)
+
+
+def _extra_column(name, factory):
+    # Helper function to build a view property for a sparse attribute that is usually empty; like Patient, reading
+    # it gives a container of the patient's own that can be changed in place
+    def get(view):
+        extras = view.table.extras.get(view.row)
+        value = extras.get(name) if extras else None
+        if value is None:
+            value = view.table.extras.setdefault(view.row, {})[name] = factory()
+        return value
+
+    def set(view, value):
+        view.table.extras.setdefault(view.row, {})[name] = value
+    return property(get, set)
+
+
+class PatientView:  # Defining a class that exposes one PatientTable row with the same API as Patient
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table  # Table holding the patient's data
+        self.row = row  # Row index of the patient in the table
+
+    id = _column("ids")
+    name = _column("names")
+    age = _column("ages")
+    address = _column("addresses")
+    phone_number = _column("phone_numbers")
+    email = _column("emails")
+    risk_level = _column("risk_levels")
+    gender = _pooled_column("genders")
+    medical_condition = _pooled_column("conditions")
+    height = _measurement_column("heights_cm", HEIGHT_UNITS, "cm")
+    weight = _measurement_column("weights_kg", WEIGHT_UNITS, "kg")
+    allergies = _extra_column("allergies", list)
+    previous_surgeries = _extra_column("previous_surgeries", list)
+    vital_signs = _extra_column("vital_signs", dict)
+    prescriptions = _extra_column("prescriptions", list)
+
+    @property
+    def height_cm(self):
+        number = self.table.heights_cm[self.row]
+        return None if math.isnan(number) else number  # Height in cm, like Patient.height_cm
+
+    @property
+    def weight_kg(self):
+        number = self.table.weights_kg[self.row]
+        return None if math.isnan(number) else number  # Weight in kg, like Patient.weight_kg
+
+    def add_vital_sign(self, key, value):
+        # Method to add a vital sign for the patient
+        extras = self.table.extras.setdefault(self.row, {})
+        extras.setdefault("vital_signs", {})[key] = value
+
+    def add_prescription(self, prescription):
+        # Method to add a prescription for the patient
+        extras = self.table.extras.setdefault(self.row, {})
+        extras.setdefault("prescriptions", []).append(prescription)
+
+    def stored(self, name):
+        # Method to read allergies, previous_surgeries, vital_signs or prescriptions without creating a container
+        empty = EMPTY_MAPPING if name == "vital_signs" else EMPTY
+        return self.table.extras.get(self.row, EMPTY_MAPPING).get(name, empty)
+
+    def __lt__(self, other):
+        return self.id < other.id  # Comparing patients based on their ID
+
+
+@functools.lru_cache(maxsize=None)
+def parse_time(time):
+    # Function to convert a time string such as "10:00 AM" or "14:30" into a slot index of the day (memoized)
+    text = time.strip().upper()
+    parsed = datetime.strptime(text, "%I:%M %p" if text.endswith(("AM", "PM")) else "%H:%M")
+    return (parsed.hour * 60 + parsed.minute) // SLOT_MINUTES  # Times inside a slot fall into that slot
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(date):
+    # Function to convert a "YYYY-MM-DD" date string into a datetime at midnight (memoized)
+    return datetime.strptime(date, "%Y-%m-%d")
+
+
+@functools.lru_cache(maxsize=SLOTS_PER_DAY)
+def format_time(slot):
+    # Function to convert a slot index of the day back into a time string such as "10:00 AM" (memoized)
+    minutes = slot * SLOT_MINUTES
+    return datetime(2000, 1, 1, minutes // 60, minutes % 60).strftime("%I:%M %p")
+
+
+class DaySchedule:  # Defining a class for one doctor-day of fixed-size slots stored as bitmaps
+    __slots__ = ("open_mask", "booked_mask")
+
+    def __init__(self):
+        # Initializing the DaySchedule with no open and no booked slots
+        self.open_mask = 0  # Bit i is set when slot i is offered by the doctor
+        self.booked_mask = 0  # Bit i is set when slot i has been booked
+
+    def open_slots(self, slot, count=1):
+        # Method to offer count consecutive slots starting at slot
+        if slot + count > SLOTS_PER_DAY:
+            raise ValueError("Schedule slots cannot run past the end of the day")
+        self.open_mask |= ((1 << count) - 1) << slot
+
+    def free_mask(self):
+        # Method to get the bitmap of slots that are offered and not booked
+        return self.open_mask & ~self.booked_mask
+
+    def is_free(self, slot, count=1):
+        # Method to check if count consecutive slots starting at slot are all free (O(1))
+        mask = ((1 << count) - 1) << slot
+        return slot + count <= SLOTS_PER_DAY and self.free_mask() & mask == mask
+
+    def first_free(self, slot=0, count=1):
+        # Method to find the first slot >= slot that starts a run of count free slots, or None
+        free = runs = self.free_mask()
+        for shift in range(1, count):  # Keep only bits followed by count - 1 free slots
+            runs &= free >> shift
+        runs >>= slot
+        if not runs:
+            return None
+        return slot + (runs & -runs).bit_length() - 1  # Position of the lowest set bit
+
+    def book(self, slot, count=1):
+        # Method to book count consecutive slots starting at slot; returns False if any of them is not free
+        if not self.is_free(slot, count):
+            return False
+        self.booked_mask |= ((1 << count) - 1) << slot
+        return True
+
+    def release(self, slot, count=1):
+        # Method to cancel a booking of count consecutive slots starting at slot
+        self.booked_mask &= ~(((1 << count) - 1) << slot)
+
+    def free_slots(self):
+        # Method to yield the free slot indexes in time order
+        free = self.free_mask()
+        while free:
+            lowest = free & -free
+            yield lowest.bit_length() - 1
+            free ^= lowest
+
+    def __iter__(self):
+        return (format_time(slot) for slot in self.free_slots())  # Iterate free times as strings
+
+
 class Doctor:  # Defining a class for Doctor
+    __slots__ = ("id", "name", "specialization", "address", "phone_number", "email", "schedule", "dates")
+
     def __init__(self, id, name, specialization, address, phone_number, email):
         # Initializing the Doctor class with various attributes
         self.id = id  # Doctor ID
@@ -43,41 +404,1771 @@ class Doctor:  # Defining a class for Doctor
         self.address = address  # Doctor's address
         self.phone_number = phone_number  # Doctor's phone number
         self.email = email  # Doctor's email
-        self.schedule = {}  # Dictionary to store doctor's schedule
+        self.schedule = {}  # Dictionary to store doctor's schedule (date -> DaySchedule)
+        self.dates = []  # Sorted list of the dates in the schedule
 
     def add_schedule(self, date, time):
         # Method to add a schedule for the doctor
-        if date in self.schedule:  # If date already exists in the schedule
-            self.schedule[date].append(time)  # Append the new time to the existing date
-        else:  # If date does not exist in the schedule
-            self.schedule[date] = [time]  # Create a new entry for the date with the new time
+        self.add_schedule_range(date, time, count=1)  # Open a single slot
+
+    def add_schedule_range(self, date, time, count):
+        # Method to open count consecutive slots starting at the given time
+        if date not in self.schedule:  # If date does not exist in the schedule
+            self.schedule[date] = DaySchedule()  # Create a new entry for the date
+            bisect.insort(self.dates, date)  # Keep the dates sorted for chronological scans
+        self.schedule[date].open_slots(parse_time(time), count)
 
-    def is_available(self, date, time):
+    def is_available(self, date, time, count=1):
         # Method to check if the doctor is available at a specific date and time
-        return self.schedule.get(date) and time not in self.schedule[date]  # Check if time slot is available
+        day = self.schedule.get(date)
+        return day is not None and day.is_free(parse_time(time), count)  # Check if time slot is free
+
+    def first_available(self, date, time="00:00", count=1):
+        # Method to get the first free time at or after the given time on a date, or None
+        day = self.schedule.get(date)
+        slot = day.first_free(parse_time(time), count) if day else None
+        return format_time(slot) if slot is not None else None
+
+    def book(self, date, time, count=1):
+        # Method to book count consecutive slots starting at the given time; returns False if not free
+        day = self.schedule.get(date)
+        return day is not None and day.book(parse_time(time), count)
+
+    def free_slot_times(self, after=None):
+        # Method to lazily yield (datetime, doctor ID, doctor) for every free slot starting at or after a datetime
+        if after is None:  # No lower bound: start from the first date in the schedule
+            first_date, first_slot, idx = None, 0, 0
+        else:
+            first_date = after.strftime("%Y-%m-%d")
+            first_slot = -(-(after.hour * 60 + after.minute) // SLOT_MINUTES)  # Round up to the next slot start
+            idx = bisect.bisect_left(self.dates, first_date)  # Skip past dates without scanning them
+        for idx in range(idx, len(self.dates)):
+            date = self.dates[idx]
+            day = self.schedule[date]
+            slot = first_slot if date == first_date else 0
+            while True:
+                slot = day.first_free(slot)
+                if slot is None:
+                    break
+                yield parse_date(date) + timedelta(minutes=slot * SLOT_MINUTES), self.id, self
+                slot += 1
 
     def get_available_times(self, date):
         # Method to get the available times for the doctor on a specific date
-        return [(time, idx + 1) for idx, time in enumerate(self.schedule.get(date, []))]
+        return [(time, idx + 1) for idx, time in enumerate(self.schedule.get(date, ()))]
         # Return available times along with their indices
 
 
 class Prescription:  # Defining a class for Prescription
-    def __init__(self, medication, dosage, frequency, instructions):
+    __slots__ = ("medication", "dosage", "frequency", "instructions", "issued")
+
+    def __init__(self, medication, dosage, frequency, instructions, issued=None):
         # Initializing the Prescription class with various attributes
         self.medication = medication  # Prescription medication
         self.dosage = dosage  # Dosage of the medication
         self.frequency = frequency  # Frequency of medication intake
         self.instructions = instructions  # Instructions for taking the medication
+        self.issued = issued  # Time the prescription was issued (None if unknown)
 
 
-class HospitalSystem:  # Defining a class for HospitalSystem
+class Registry:  # Defining a class for an indexed collection of records (patients or doctors)
+    def __init__(self, indexed_fields=()):
+        # Initializing the Registry with a primary index on ID and secondary indexes on the given fields
+        self.records = {}  # Primary index: record ID -> record
+        self.indexes = {field: {} for field in indexed_fields}  # Secondary indexes: field -> value -> {ID: record}
+
+    def add(self, record, index=True):
+        # Method to insert a record, rejecting duplicate IDs (index=False defers secondary indexing to rebuild_indexes)
+        if record.id in self.records:  # If the ID is already registered
+            raise ValueError(f"Duplicate ID: {record.id}")
+        self.records[record.id] = record  # Add record to the primary index
+        if index:
+            for field, index in self.indexes.items():  # Add record to every secondary index
+                index.setdefault(getattr(record, field), {})[record.id] = record
+
+    def rebuild_indexes(self):
+        # Method to rebuild every secondary index from the primary index in one pass
+        for field in self.indexes:
+            index = self.indexes[field] = {}
+            for record_id, record in self.records.items():
+                index.setdefault(getattr(record, field), {})[record_id] = record
+
+    def get(self, record_id):
+        # Method to look up a record by ID in O(1)
+        return self.records.get(record_id)  # Return the record or None if not found
+
+    def find(self, field, value):
+        # Method to look up all records whose indexed field equals the given value
+        return list(self.indexes[field].get(value, {}).values())  # Return matching records in insertion order
+
+    def update(self, record_id, **changes):
+        # Method to change fields of a record while keeping the secondary indexes consistent
+        record = self.records[record_id]  # Find record by ID (raises KeyError if missing)
+        for field, value in changes.items():
+            index = self.indexes.get(field)  # Secondary index for this field, if any
+            if index is not None:
+                self._unindex(index, getattr(record, field), record_id)  # Drop the old value from the index
+            setattr(record, field, value)  # Update the record
+            if index is not None:
+                index.setdefault(value, {})[record_id] = record  # Index the new value
+        return record
+
+    def remove(self, record_id):
+        # Method to remove a record from the primary and secondary indexes
+        record = self.records.pop(record_id)  # Remove from primary index (raises KeyError if missing)
+        for field, index in self.indexes.items():
+            self._unindex(index, getattr(record, field), record_id)
+        return record
+
+    def _unindex(self, index, value, record_id):
+        # Helper method to remove one record ID from a secondary index bucket
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(record_id, None)
+            if not bucket:  # Drop empty buckets so the index does not grow with stale values
+                del index[value]
+
+    def __len__(self):
+        return len(self.records)  # Number of records
+
+    def __iter__(self):
+        return iter(self.records.values())  # Iterate records in insertion order
+
+    def __contains__(self, record_id):
+        return record_id in self.records  # Check whether an ID is registered
+
+
+class TriageQueue:  # Defining a class for the priority calling queue (highest risk level first, then arrival order)
     def __init__(self):
+        # Initializing the TriageQueue as a binary heap with lazy deletion
+        self.heap = []  # Heap entries: [-risk_level, arrival sequence, tie-breaker, patient]; patient is None once removed
+        self.entries = {}  # Map of patient ID -> live heap entry
+        self.counter = itertools.count()  # Arrival sequence used to keep equal risk levels in arrival order
+        self.depth = Counter()  # Risk level -> number of queued patients
+
+    def push(self, patient):
+        # Method to add a patient to the queue, or re-prioritize them if already queued (O(log n))
+        if patient.id in self.entries:
+            self.reprioritize(patient)
+            return
+        arrival = next(self.counter)
+        entry = [-patient.risk_level, arrival, arrival, patient]
+        self.entries[patient.id] = entry
+        self.depth[patient.risk_level] += 1
+        heapq.heappush(self.heap, entry)
+
+    def extend(self, patients):
+        # Method to add many patients at once: heapifying a single time (O(n)) when they outnumber the queued ones,
+        # otherwise pushing them one by one (O(k log n)), so small batches do not re-heapify a large queue
+        added = []
+        for patient in patients:
+            if patient.id in self.entries:
+                self.reprioritize(patient)
+                continue
+            arrival = next(self.counter)
+            entry = [-patient.risk_level, arrival, arrival, patient]
+            self.entries[patient.id] = entry
+            self.depth[patient.risk_level] += 1
+            added.append(entry)
+        if len(added) * max(1, len(self.heap).bit_length()) < len(self.heap) + len(added):
+            for entry in added:
+                heapq.heappush(self.heap, entry)
+        else:
+            self.heap.extend(added)
+            heapq.heapify(self.heap)
+
+    def pop(self):
+        # Method to remove and return the next patient to be called (O(log n) amortized)
+        while self.heap:
+            risk, _, _, patient = heapq.heappop(self.heap)
+            if patient is not None:  # Skip entries that were lazily removed
+                del self.entries[patient.id]
+                self.depth[-risk] -= 1
+                return patient
+        raise IndexError("pop from an empty queue")
+
+    def remove(self, patient):
+        # Method to remove a patient from the queue (raises ValueError like list.remove if not queued)
+        entry = self.entries.pop(patient.id, None)
+        if entry is None:
+            raise ValueError(f"{patient.id} is not in the queue")
+        entry[3] = None  # Mark the heap entry as removed; it is discarded when it reaches the top
+        self.depth[-entry[0]] -= 1
+        self._compact()
+
+    def discard(self, patient):
+        # Method to remove a patient from the queue if present
+        if patient.id in self.entries:
+            self.remove(patient)
+
+    def reprioritize(self, patient):
+        # Method to move a queued patient after their risk level changed, keeping their arrival order
+        entry = self.entries[patient.id]
+        if entry[0] == -patient.risk_level:
+            return
+        entry[3] = None  # Invalidate the old entry
+        self.depth[-entry[0]] -= 1
+        self.depth[patient.risk_level] += 1
+        new_entry = [-patient.risk_level, entry[1], next(self.counter), patient]  # Keep the original arrival order
+        self.entries[patient.id] = new_entry
+        heapq.heappush(self.heap, new_entry)
+        self._compact()
+
+    def peek(self, n):
+        # Method to yield the next n patients in calling order without copying or modifying the queue (O(n log n))
+        heap = self.heap
+        frontier = [(heap[0], 0)] if heap else []  # Best-first walk of the heap tree
+        while frontier and n > 0:
+            entry, idx = heapq.heappop(frontier)
+            if entry[3] is not None:
+                yield entry[3]
+                n -= 1
+            for child in (2 * idx + 1, 2 * idx + 2):  # Children are never smaller than their parent
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def _compact(self):
+        # Helper method to drop removed entries from the top (so peeking at the next patient stays O(1)) and to
+        # rebuild the heap once removed entries make up more than half of it
+        heap = self.heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self.entries) + 16:
+            self.heap = [entry for entry in self.heap if entry[3] is not None]
+            heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.entries)  # Number of queued patients
+
+    def __iter__(self):
+        # Iterate patients in calling order; a full listing sorts the live entries in C rather than walking the heap
+        # in Python like peek. entries holds them in arrival order (reprioritize keeps a patient's place in the
+        # dict), so a stable sort on the risk level alone gives the calling order
+        return map(operator.itemgetter(3), sorted(self.entries.values(), key=operator.itemgetter(0)))
+
+    def __contains__(self, patient):
+        return patient.id in self.entries  # Check whether a patient is queued
+
+
+class LogHistogram:  # Defining a class for quantiles of a changing set of values, counted in log-spaced bins
+    # Adding or removing a value is O(1); a quantile is read in one pass over the occupied bins and is within the
+    # relative precision of the true value (values below 1 share the lowest bin and read as 0)
+    def __init__(self, precision=0.01):
+        # Initializing the LogHistogram
+        self.base = (1 + precision) ** 2  # Bin width ratio; bin centers are within precision of every value in them
+        self.log_base = math.log(self.base)
+        self.counts = Counter()  # Bin -> number of values in it
+        self.total = 0  # Number of values
+
+    def bin(self, value):
+        return 0 if value < 1 else int(math.log(value) / self.log_base) + 1  # Bin of a value
+
+    def add(self, value):
+        self.counts[self.bin(value)] += 1
+        self.total += 1
+
+    def remove(self, value):
+        # Method to remove a value that was added
+        key = self.bin(value)
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.counts[key]
+        self.total -= 1
+
+    def quantile(self, q):
+        # Method to estimate the q-th quantile (0 <= q <= 1), or None if there are no values
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(q * self.total))  # Nearest-rank definition
+        for key in sorted(self.counts):
+            rank -= self.counts[key]
+            if rank <= 0:
+                return 0.0 if key == 0 else self.base ** (key - 0.5)  # Geometric center of the bin
+        return None
+
+
+class QueueStats:  # Defining a class for live queue metrics, updated in O(1) per queue event
+    # Timestamps come from the logged operations (so recovery reproduces them) and never move backwards
+    def __init__(self, window=3600.0):
+        # Initializing the QueueStats
+        self.now = 0.0  # Latest event time seen
+        self.arrivals = {}  # Patient ID -> time the patient was added to the system
+        self.enqueued_at = {}  # Patient ID -> time the patient entered the consultation queue
+        self.window = window  # Seconds covered by the rolling mean wait and throughput
+        self.recent = deque()  # (call time, wait) of patients called within the window
+        self.recent_total = 0.0  # Sum of the waits in recent
+        self.called = 0  # Patients called since the start
+        self.waits = LogHistogram()  # Waits in recent, for the rolling p95
+
+    def clock(self, timestamp=None):
+        # Method to advance the event clock; a missing or earlier timestamp reuses the latest time
+        if timestamp is not None and timestamp > self.now:
+            self.now = timestamp
+        return self.now
+
+    def arrived(self, patient_id, timestamp=None):
+        # Method to record that a patient was added to the system (operations logged before timestamps stay unknown)
+        if timestamp is not None:
+            self.arrivals[patient_id] = self.clock(timestamp)
+
+    def enqueued(self, patient_id, timestamp=None):
+        # Method to record that a patient entered the consultation queue
+        self.enqueued_at[patient_id] = self.clock(timestamp)
+
+    def dequeued(self, patient_id, timestamp=None, called=False):
+        # Method to record that a patient left the queue; only called patients count towards waits and throughput
+        now = self.clock(timestamp)
+        since = self.enqueued_at.pop(patient_id, None)
+        if called and since is not None:
+            wait = now - since
+            self.called += 1
+            self.waits.add(wait)
+            self.recent.append((now, wait))
+            self.recent_total += wait
+            self.expire(now)
+
+    def expire(self, now):
+        # Helper method to drop calls older than the window (amortized O(1) per call)
+        recent = self.recent
+        while recent and recent[0][0] < now - self.window:
+            wait = recent.popleft()[1]
+            self.recent_total -= wait
+            self.waits.remove(wait)
+
+    def arrival_time(self, patient_id):
+        # Method to get when a patient arrived as a datetime, or None if unknown
+        timestamp = self.arrivals.get(patient_id)
+        return datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+    def stats(self, depth, now=None):
+        # Method to get a snapshot of the metrics; depth is the queue's risk level -> count mapping
+        self.expire(max(self.now, now if now is not None else time.time()))
+        recent = len(self.recent)
+        return {
+            "depth": sum(depth.values()),
+            "depth_by_risk": {risk: count for risk, count in sorted(depth.items(), reverse=True) if count},
+            "called": self.called,
+            "mean_wait": self.recent_total / recent if recent else None,  # Seconds, over the window
+            "p95_wait": self.waits.quantile(0.95),  # Seconds, over the window
+            "throughput_per_hour": recent * 3600.0 / self.window,
+        }
+
+    def dump(self):
+        # Method to convert the metrics into JSON-compatible data
+        return {"now": self.now, "arrivals": self.arrivals, "enqueued_at": self.enqueued_at,
+                "recent": list(self.recent), "called": self.called}
+
+    def load(self, data):
+        # Method to restore metrics made by dump
+        self.now = data["now"]
+        self.arrivals.update(data["arrivals"])
+        self.enqueued_at.update(data["enqueued_at"])
+        self.recent = deque(tuple(item) for item in data["recent"])
+        self.recent_total = sum(wait for _, wait in self.recent)
+        for _, wait in self.recent:
+            self.waits.add(wait)
+        self.called = data["called"]
+
+
+VITAL_PATTERN = re.compile(r"\s*(-?[0-9]*\.?[0-9]+)\s*(?:/\s*(-?[0-9]*\.?[0-9]+))?\s*(.*?)\s*$")
+DEFAULT_VITAL_THRESHOLDS = {  # Metric -> (low, high) alert limits, in the units readings are normalized to
+    "Body Temperature": (95.0, 100.4),  # °F
+    "Pulse Rate": (50.0, 120.0),  # bpm
+    "Blood Pressure (systolic)": (90.0, 180.0),  # mmHg
+    "Blood Pressure (diastolic)": (60.0, 120.0),  # mmHg
+    "Respiratory Rate": (10.0, 24.0),  # breaths/min
+    "Oxygen Saturation": (92.0, 100.0),  # %
+}
+
+
+def parse_vital_sign(key, value):
+    # Function to turn a reading such as "101°F" or "120/80 mmHg" into a list of (metric, number, unit)
+    key = key.strip()
+    if isinstance(value, (int, float)):
+        return [(key, float(value), "")]
+    match = VITAL_PATTERN.match(str(value))
+    if not match:
+        return []  # Free-form readings are kept as text only
+    first, second, unit = match.groups()
+    number = float(first)
+    if unit.upper() in ("°C", "C"):  # Normalize Celsius temperatures to Fahrenheit
+        number, unit = number * 9 / 5 + 32, "°F"
+    if second is not None:  # Two-part readings such as blood pressure
+        return [(f"{key} (systolic)", number, unit), (f"{key} (diastolic)", float(second), unit)]
+    return [(key, number, unit)]
+
+
+def vital_sign_error(key, value):
+    # Function to check that a vital sign reading can be recorded; returns an error message or None if it is valid
+    if not isinstance(key, str) or not key.strip():
+        return f"vital sign name {key!r} must be a non-empty string"
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return f"vital sign value {value!r} must be a number or text such as '120/80 mmHg'"
+    return None
+
+
+class VitalSeries:  # Defining a class for the reading history of one metric of one patient
+    __slots__ = ("times", "values", "start", "unit", "state", "appended", "saved", "stored")
+
+    def __init__(self, unit):
+        self.times = array("d")  # Reading timestamps in seconds, in time order
+        self.values = array("d")  # Reading values
+        self.start = 0  # Index of the oldest retained reading
+        self.unit = unit  # Unit of the values
+        self.state = "normal"  # Alert state of the latest reading: "normal", "low" or "high"
+        self.appended = 0  # Readings added so far
+        self.saved = 0  # Value of appended when the series was last saved (-1: the whole series must be saved again)
+        self.stored = 0  # Readings of the series held by the storage backend
+
+    def append(self, timestamp, value, capacity):
+        # Method to add a reading, dropping the oldest ones beyond capacity (amortized O(1)); a reading older than the
+        # latest one is inserted at its place in time; returns whether the reading is the latest
+        latest = len(self.times) == self.start or timestamp >= self.times[-1]
+        if latest:
+            self.times.append(timestamp)
+            self.values.append(value)
+        else:  # Out of order: keep the times sorted, which window relies on
+            i = bisect.bisect_right(self.times, timestamp, self.start)
+            self.times.insert(i, timestamp)
+            self.values.insert(i, value)
+            self.saved = -1  # The new readings are no longer just the last ones
+        self.appended += 1
+        if len(self.values) - self.start > capacity:
+            self.start = len(self.values) - capacity
+            if self.start >= capacity:  # Compact once the dropped prefix is as large as the kept part
+                del self.times[:self.start]
+                del self.values[:self.start]
+                self.start = 0
+        return latest
+
+    def window(self, since):
+        # Method to get the (times, values) arrays of readings taken at or after since
+        first = bisect.bisect_left(self.times, since, self.start)
+        return self.times[first:], self.values[first:]
+
+    def __len__(self):
+        return len(self.values) - self.start  # Number of retained readings
+
+
+class VitalSignsStore:  # Defining a class for time-series storage of patients' vital signs with threshold alerts
+    def __init__(self, capacity=4096, thresholds=None, on_alert=None, max_alerts=10000):
+        # Initializing the VitalSignsStore
+        self.capacity = capacity  # Readings kept per patient and metric
+        self.thresholds = DEFAULT_VITAL_THRESHOLDS if thresholds is None else thresholds  # Metric -> (low, high)
+        self.on_alert = on_alert  # Optional callback called with each new alert
+        self.series = {}  # Patient ID -> {metric: VitalSeries}
+        self.alerts = deque(maxlen=max_alerts)  # Most recent alerts as (timestamp, patient ID, metric, value, state)
+
+    def record(self, patient_id, key, value, timestamp=None):
+        # Method to store a reading; returns the alerts it raised
+        timestamp = time.time() if timestamp is None else timestamp
+        raised = []
+        patient_series = self.series.setdefault(patient_id, {})
+        for metric, number, unit in parse_vital_sign(key, value):
+            series = patient_series.get(metric)
+            if series is None:
+                series = patient_series[metric] = VitalSeries(unit)
+            latest = series.append(timestamp, number, self.capacity)
+            limits = self.thresholds.get(metric)
+            if limits is not None and latest:  # Check the new reading only, instead of rescanning the history
+                state = "low" if number < limits[0] else "high" if number > limits[1] else "normal"
+                if state != series.state:
+                    series.state = state
+                    if state != "normal":  # Alert when a reading crosses out of range, not on every abnormal one
+                        alert = (timestamp, patient_id, metric, number, state)
+                        self.alerts.append(alert)
+                        raised.append(alert)
+                        if self.on_alert:
+                            self.on_alert(alert)
+        return raised
+
+    def latest(self, patient_id, metric):
+        # Method to get the latest (timestamp, value) of a metric, or None
+        series = self.series.get(patient_id, {}).get(metric)
+        if not series:
+            return None
+        return series.times[-1], series.values[-1]
+
+    def metrics(self, patient_id):
+        # Method to list the metrics recorded for a patient
+        return list(self.series.get(patient_id, ()))
+
+    def aggregate(self, patient_id, metric, minutes, now=None):
+        # Method to get count, min, max, mean and trend slope (per minute) over the last minutes, or None
+        series = self.series.get(patient_id, {}).get(metric)
+        if series is None:
+            return None
+        now = time.time() if now is None else now
+        times, values = series.window(now - minutes * 60)
+        count = len(values)
+        if not count:
+            return None
+        total = sum(values)  # Reductions run over the array slices in C
+        mean = total / count
+        slope = 0.0
+        if count > 1:  # Least-squares slope of value against time
+            times = array("d", map(times[0].__rsub__, times))  # Shift times to start at 0 to keep precision
+            sum_t = sum(times)
+            sum_tt = sum(map(operator.mul, times, times))
+            sum_tv = sum(map(operator.mul, times, values))
+            denominator = count * sum_tt - sum_t * sum_t
+            if denominator:
+                slope = (count * sum_tv - sum_t * total) / denominator * 60
+        return {"count": count, "min": min(values), "max": max(values), "mean": mean, "slope": slope,
+                "unit": series.unit}
+
+    def changes(self):
+        # Generator method to collect the readings added since it last ran, for saving the history incrementally
+        # instead of in full; yields (patient ID, metric, unit, times bytes, values bytes, replace) per changed
+        # series, where replace means the series' saved readings are replaced rather than extended (after an
+        # out-of-order reading, or once they reach twice the capacity, so saved history stays bounded)
+        for patient_id, patient_series in self.series.items():
+            for metric, series in patient_series.items():
+                count = min(series.appended - series.saved, len(series))
+                if series.saved >= 0 and not count:
+                    continue
+                replace = series.saved < 0 or series.stored + count > 2 * self.capacity
+                if replace:
+                    count = series.stored = len(series)
+                else:
+                    series.stored += count
+                series.saved = series.appended
+                end = len(series.times)
+                yield (patient_id, metric, series.unit, series.times[end - count:].tobytes(),
+                       series.values[end - count:].tobytes(), replace)
+
+    def load_chunk(self, patient_id, metric, unit, times, values):
+        # Method to restore readings saved from changes (times and values are bytes of float64 arrays)
+        series = self.series.setdefault(patient_id, {}).get(metric)
+        if series is None:
+            series = self.series[patient_id][metric] = VitalSeries(unit)
+        series.times.frombytes(times)
+        series.values.frombytes(values)
+        count = len(values) // series.values.itemsize
+        series.appended += count
+        series.saved = series.appended
+        series.stored += count
+        if len(series) > self.capacity:  # Keep only the latest capacity readings
+            del series.times[:len(series.times) - self.capacity]
+            del series.values[:len(series.values) - self.capacity]
+            series.start = 0
+        self._restore_state(metric, series)
+
+    def load(self, data):
+        # Method to restore history from snapshots written before the history was saved separately
+        for patient_id, patient_series in data.items():
+            for metric, (unit, times, values) in patient_series.items():
+                series = self.series.setdefault(patient_id, {})[metric] = VitalSeries(unit)
+                series.times.extend(times)
+                series.values.extend(values)
+                series.appended = len(values)  # Not saved yet: the next snapshot saves it
+                self._restore_state(metric, series)
+
+    def _restore_state(self, metric, series):
+        # Helper method to set the alert state of a restored series from its latest reading
+        limits = self.thresholds.get(metric)
+        if limits is not None and len(series):
+            value = series.values[-1]
+            series.state = "low" if value < limits[0] else "high" if value > limits[1] else "normal"
+
+
+DEFAULT_MEDICATIONS = (  # (code, name, dosage, units in stock, allergies that rule the medication out)
+    ("N02BA01", "Aspirin", "325 mg", 500, ("Aspirin", "Salicylates", "NSAIDs")),
+    ("M01AE01", "Ibuprofen", "200 mg", 500, ("Ibuprofen", "NSAIDs")),
+    ("N02BE01", "Paracetamol", "500 mg", 500, ("Paracetamol", "Acetaminophen")),
+    ("J01CA04", "Antibiotics", "500 mg", 500, ("Antibiotics", "Penicillin", "Amoxicillin")),
+    ("R06AE07", "Antihistamines", "10 mg", 500, ("Antihistamines", "Cetirizine")),
+)
+
+
+class Medication:  # Defining a class for a catalog medication and its stock level
+    __slots__ = ("code", "name", "dosage", "stock", "held", "contraindications")
+
+    def __init__(self, code, name, dosage, stock=0, contraindications=()):
+        # Initializing the Medication class with various attributes
+        self.code = code  # Catalog code
+        self.name = name  # Medication name
+        self.dosage = dosage  # Dosage per unit
+        self.stock = stock  # Units on hand
+        self.held = 0  # Units reserved by requests that are not dispensed yet
+        self.contraindications = tuple(contraindications)  # Allergies that rule this medication out
+
+    @property
+    def available(self):
+        return self.stock - self.held  # Units that can still be reserved
+
+
+def valid_quantity(quantity):
+    # Function to check that a number of units is a positive whole number (bools are not accepted as numbers)
+    return isinstance(quantity, int) and not isinstance(quantity, bool) and quantity > 0
+
+
+class Pharmacy:  # Defining a class for the medication catalog with stock reservation and allergy checks
+    def __init__(self, medications=DEFAULT_MEDICATIONS):
+        # Initializing the Pharmacy
+        self.medications = {}  # Code -> Medication, in catalog order
+        self.names = {}  # Case-folded name -> Medication
+        self.contraindicated = {}  # Case-folded allergy -> set of codes of the medications it rules out
+        self.lock = threading.Lock()  # Makes check-and-reserve atomic for concurrent callers
+        for medication in medications:
+            self.add(Medication(*medication))
+
+    def add(self, medication):
+        # Method to add a medication to the catalog, or replace the one with the same code
+        old = self.medications.get(medication.code)
+        if old is not None:
+            self.names.pop(old.name.casefold(), None)
+            for allergy in old.contraindications:
+                self.contraindicated[allergy.casefold()].discard(old.code)
+            medication.held = old.held
+        self.medications[medication.code] = medication
+        self.names[medication.name.casefold()] = medication
+        for allergy in medication.contraindications:
+            self.contraindicated.setdefault(allergy.casefold(), set()).add(medication.code)
+
+    def find(self, key):
+        # Method to find a medication by code, name, or 1-based position in the catalog listing (menu choices)
+        medication = self.medications.get(key) or self.names.get(str(key).casefold())
+        if medication is None and str(key).isdigit() and 1 <= int(key) <= len(self.medications):
+            medication = list(self.medications.values())[int(key) - 1]
+        return medication
+
+    def allergies_against(self, patient, medication):
+        # Method to list the patient's allergies that rule a medication out (one table lookup per allergy)
+        return [allergy for allergy in patient.stored("allergies")
+                if medication.code in self.contraindicated.get(allergy.casefold(), EMPTY)]
+
+    def reserve(self, code, quantity=1):
+        # Method to hold stock for a request; returns False, holding nothing, if too few units are available
+        with self.lock:
+            medication = self.medications[code]
+            if medication.available < quantity:
+                return False
+            medication.held += quantity
+            return True
+
+    def reserve_many(self, requests):
+        # Method to hold stock for many (code, quantity) requests under one lock; returns a list of booleans
+        reserved = []
+        with self.lock:
+            for code, quantity in requests:
+                medication = self.medications[code]
+                ok = medication.available >= quantity
+                if ok:
+                    medication.held += quantity
+                reserved.append(ok)
+        return reserved
+
+    def release(self, code, quantity=1):
+        # Method to drop a hold made by reserve
+        with self.lock:
+            self.medications[code].held -= quantity
+
+    def dispense(self, code, quantity=1):
+        # Method to take units out of stock (holds are released separately by the caller that made them)
+        self.medications[code].stock -= quantity
+
+    def restock(self, code, quantity):
+        # Method to add units to stock
+        self.medications[code].stock += quantity
+
+    def dump(self):
+        # Method to convert the catalog into JSON-compatible data (holds are transient and not saved)
+        return [[medication.code, medication.name, medication.dosage, medication.stock,
+                 list(medication.contraindications)] for medication in self.medications.values()]
+
+    def load(self, data):
+        # Method to replace the catalog with one made by dump
+        self.medications, self.names, self.contraindicated = {}, {}, {}
+        for medication in data:
+            self.add(Medication(*medication))
+
+    def __len__(self):
+        return len(self.medications)  # Number of catalog medications
+
+    def __iter__(self):
+        return iter(self.medications.values())  # Medications in catalog order
+
+
+TOKEN_PATTERN = re.compile(r"[a-z]+|[0-9]+")
+
+
+def search_tokens(text):
+    # Function to normalize free text (case, whitespace, stray spaces in emails) into search tokens
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    digit_groups = [token for token in tokens if token.isdigit()]
+    if len(digit_groups) > 1:  # Phone numbers can be typed with or without separators
+        tokens.append("".join(digit_groups))
+    return tokens
+
+
+def trigrams(token):
+    # Function to get the character trigrams of a token padded with spaces
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PatientSearchIndex:  # Defining a class for typo-tolerant patient search over name, phone, email and address
+    # Two levels: an inverted index from each distinct term to the patients containing it, and a trigram index over
+    # the (much smaller) vocabulary of terms, used to expand misspelled or partial query words into known terms
+    def __init__(self, candidates=5000, expansions=50):
+        # Initializing the PatientSearchIndex
+        self.terms = []  # Term ID -> term
+        self.term_ids = {}  # Term -> term ID
+        self.postings = []  # Term ID -> array of document numbers containing the term
+        self.term_grams = {}  # Trigram (or leading bigram) -> array of term IDs containing it
+        self.documents = []  # Document number -> (patient ID, term IDs), or None once replaced/removed
+        self.current = {}  # Patient ID -> current document number
+        self.stale = 0  # Number of replaced or removed documents still referenced by postings
+        self.candidates = candidates  # Patients gathered per query word before intersecting
+        self.expansions = expansions  # Known terms a misspelled query word may stand for
+
+    def terms_of(self, patient):
+        # Method to get the searchable terms of a patient; fields are split separately so digit groups only join
+        # within one phone number (the email is joined first to drop stray spaces)
+        email = "".join((patient.email or "").split())
+        terms = set()
+        for field in (patient.name, patient.phone_number, email, patient.address):
+            terms.update(search_tokens(field or ""))
+        return terms
+
+    def term_id(self, term):
+        # Method to get the ID of a term, adding it to the vocabulary if it is new
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.postings.append(array("I"))
+            for gram in trigrams(term) | {f" {term[0]}"}:  # The leading bigram serves one-letter prefixes
+                term_ids = self.term_grams.get(gram)
+                if term_ids is None:
+                    term_ids = self.term_grams[gram] = array("I")
+                term_ids.append(term_id)
+        return term_id
+
+    def add(self, patient):
+        # Method to index a patient, or re-index them if their searchable text changed (no full rebuild)
+        term_ids = tuple(sorted(self.term_id(term) for term in self.terms_of(patient)))
+        number = self.current.get(patient.id)
+        if number is not None:
+            if self.documents[number][1] == term_ids:
+                return
+            self.documents[number] = None  # Documents are immutable: the old version is dropped lazily
+            self.stale += 1
+        number = self.current[patient.id] = len(self.documents)
+        self.documents.append((patient.id, term_ids))
+        for term_id in term_ids:
+            self.postings[term_id].append(number)
+        if self.stale > len(self.current):  # Compact once most of the postings are stale
+            self.rebuild()
+
+    def remove(self, patient_id):
+        # Method to drop a patient from search results
+        number = self.current.pop(patient_id, None)
+        if number is not None:
+            self.documents[number] = None
+            self.stale += 1
+
+    def rebuild(self):
+        # Method to rebuild the postings from the current documents, dropping stale entries
+        documents = [document for document in self.documents if document is not None]
+        self.documents, self.current, self.stale = [], {}, 0
+        self.postings = [array("I") for _ in self.terms]
+        for patient_id, term_ids in documents:
+            number = self.current[patient_id] = len(self.documents)
+            self.documents.append((patient_id, term_ids))
+            for term_id in term_ids:
+                self.postings[term_id].append(number)
+
+    def expand(self, token, prefix):
+        # Method to map a query word to {term ID: similarity} for the known terms it may stand for
+        matches = {}
+        term_id = self.term_ids.get(token)
+        if term_id is not None:
+            matches[term_id] = 1.0
+        if prefix:  # Type-ahead: every term starting with the word matches, shorter completions first
+            gram = f" {token[:2]}" if len(token) > 1 else f" {token}"
+            term_ids = self.term_grams.get(gram, ())
+            if len(term_ids) <= 20 * self.expansions:  # Skip prefixes too short to narrow anything down
+                for term_id in term_ids:
+                    term = self.terms[term_id]
+                    if term.startswith(token):
+                        matches.setdefault(term_id, 0.5 + 0.5 * len(token) / len(term))
+        for i in range(len(token) - 1):  # The commonest typo, two swapped letters, is looked up directly
+            term_id = self.term_ids.get(f"{token[:i]}{token[i + 1]}{token[i]}{token[i + 2:]}")
+            if term_id is not None:
+                matches.setdefault(term_id, 0.9)
+        if not token.isdigit() and len(token) > 2:  # Other typos: terms sharing trigrams, scored by Dice similarity
+            grams = trigrams(token)
+            counts = Counter()
+            for gram in grams:
+                counts.update(self.term_grams.get(gram, ()))
+            for term_id, shared in counts.most_common(self.expansions):
+                similarity = 2 * shared / (len(grams) + len(self.terms[term_id]) + 1)
+                if similarity >= 0.25 and similarity > matches.get(term_id, 0):
+                    matches[term_id] = similarity
+        return matches
+
+    def search(self, query, limit=10, prefix=True):
+        # Method to get up to limit (score, patient ID) pairs; the score is the mean best match of the query words
+        tokens = list(dict.fromkeys(search_tokens(query)))
+        if not tokens:
+            return []
+        expanded = [self.expand(token, prefix and position == len(tokens) - 1)
+                    for position, token in enumerate(tokens)]
+        # Gather patients for the two most selective words, best matching terms first, up to a fixed budget; only
+        # patients matching both, plus the best few for each word alone, are scored
+        selective = sorted((matches for matches in expanded if matches),
+                           key=lambda matches: sum(len(self.postings[term_id]) for term_id in matches))
+        gathered = []
+        for matches in selective[:2]:
+            numbers = array("I")
+            for term_id in sorted(matches, key=matches.get, reverse=True):
+                numbers.extend(self.postings[term_id][:self.candidates - len(numbers)])
+                if len(numbers) >= self.candidates:
+                    break
+            gathered.append(numbers)
+        candidates = set()
+        for numbers in gathered:
+            candidates.update(numbers[:limit * 2])
+        if len(gathered) == 2:
+            candidates.update(set(gathered[0]).intersection(gathered[1]))
+        results = []
+        for number in candidates:
+            document = self.documents[number]
+            if document is not None:  # Skip replaced or removed documents
+                score = sum(max([matches.get(term_id, 0.0) for term_id in document[1]]) for matches in expanded)
+                results.append((round(score / len(expanded), 4), document[0]))
+        return heapq.nlargest(limit, results, key=operator.itemgetter(0))
+
+    def __len__(self):
+        return len(self.current)  # Number of indexed patients
+
+
+class EncodedColumn:  # Defining a class for a dictionary-encoded column: distinct values plus byte planes of codes
+    __slots__ = ("values", "codes", "planes")
+
+    def __init__(self, values=()):
+        # Initializing the EncodedColumn, encoding the given values in bulk
+        self.values = list(dict.fromkeys(values))  # Code -> value
+        self.codes = {value: code for code, value in enumerate(self.values)}  # Value -> code
+        numbers = list(map(self.codes.__getitem__, values))
+        width = max(1, ((len(self.values) - 1).bit_length() + 7) // 8)
+        # Plane i holds byte i of every row's code, so filters run as bytes.translate passes in C
+        self.planes = [bytearray(numbers)] if width == 1 else \
+            [bytearray([number >> shift & 255 for number in numbers]) for shift in range(0, 8 * width, 8)]
+
+    def code(self, value):
+        # Helper method to get the code of a value, adding it (and a byte plane if needed) when new
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            if code >> (8 * len(self.planes)):
+                self.planes.append(bytearray(len(self.planes[0])))
+        return code
+
+    def append(self, value):
+        code = self.code(value)
+        for plane in self.planes:
+            plane.append(code & 255)
+            code >>= 8
+
+    def set(self, row, value):
+        code = self.code(value)
+        for plane in self.planes:
+            plane[row] = code & 255
+            code >>= 8
+
+    def mask(self, test):
+        # Method to get the rows whose value passes test as an int with bit 8*row set (one translate pass per plane)
+        tables = {}  # Code bytes above the lowest -> translate table selecting the lowest byte
+        for code, value in enumerate(self.values):
+            if test(value):
+                tables.setdefault(code >> 8, bytearray(256))[code & 255] = 1
+        mask = 0
+        for high, table in tables.items():
+            part = int.from_bytes(self.planes[0].translate(table), "little")
+            for plane in self.planes[1:]:
+                equal = bytearray(256)
+                equal[high & 255] = 1
+                part &= int.from_bytes(plane.translate(equal), "little")
+                high >>= 8
+            mask |= part
+        return mask
+
+    def counts(self, flags=None):
+        # Method to count rows per value, only over rows whose flag byte is set when flags are given
+        codes = self.planes[0] if len(self.planes) == 1 else zip(*self.planes)
+        counter = Counter(itertools.compress(codes, flags) if flags is not None else codes)  # Counting runs in C
+        if len(self.planes) == 1:
+            return Counter({self.values[code]: count for code, count in counter.items()})
+        return Counter({self.values[int.from_bytes(bytes(code), "little")]: count for code, count in counter.items()})
+
+
+class ColumnShard:  # Defining a class for a block of table rows stored column by column, with cached aggregates
+    def __init__(self, columns, links=(), rows=()):
+        # Initializing the ColumnShard from row tuples (columns first, then links)
+        data = [list(map(operator.itemgetter(i), rows)) for i in range(len(columns) + len(links))]
+        self.columns = {name: EncodedColumn(values) for name, values in zip(columns, data)}
+        self.links = {name: array("I", values) for name, values in zip(links, data[len(columns):])}  # Row refs
+        self.size = len(rows)
+        self.cache = {}  # Query key -> (columns it read, result)
+
+    def append(self, row):
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+        for link, value in zip(self.links.values(), row[len(self.columns):]):
+            link.append(value)
+        self.size += 1
+        self.cache.clear()  # New rows change every aggregate of this shard
+
+    def set(self, row, name, value):
+        self.columns[name].set(row, value)
+        for key in [key for key, (read, _) in self.cache.items() if name in read]:  # Drop only what read it
+            del self.cache[key]
+
+    def aggregate(self, key, read, compute):
+        # Method to get a cached aggregate, computing it on a miss (key None means do not cache)
+        entry = self.cache.get(key) if key is not None else None
+        if entry is None:
+            entry = (read, compute(self))
+            if key is not None:
+                if len(self.cache) >= 256:
+                    del self.cache[next(iter(self.cache))]  # Drop the oldest entry
+                self.cache[key] = entry
+        return entry[1]
+
+
+class ColumnarTable:  # Defining a class for an append-only analytics table split into shards
+    def __init__(self, columns, links=(), shard_rows=ANALYTICS_SHARD_ROWS, shards=()):
+        # Initializing the ColumnarTable
+        self.names = tuple(columns)  # Dictionary-encoded columns that can be filtered and grouped
+        self.links = tuple(links)  # Columns holding row numbers of another table, used for joins
+        self.shard_rows = shard_rows
+        self.shards = list(shards)
+        self.version = 0  # Incremented on every write, so joined results cached elsewhere can tell they are stale
+
+    def extend(self, rows):
+        # Method to append many row tuples, encoding full shards in bulk
+        rows = iter(rows)
+        if self.shards:
+            for row in itertools.islice(rows, self.shard_rows - self.shards[-1].size):
+                self.shards[-1].append(row)
+        while True:
+            chunk = list(itertools.islice(rows, self.shard_rows))
+            if not chunk:
+                break
+            self.shards.append(ColumnShard(self.names, self.links, chunk))
+        self.version += 1
+
+    def append(self, row):
+        # Method to append one row tuple; returns its row number
+        if not self.shards or self.shards[-1].size >= self.shard_rows:
+            self.shards.append(ColumnShard(self.names, self.links))
+        number = len(self)
+        self.shards[-1].append(row)
+        self.version += 1
+        return number
+
+    def set(self, row, name, value):
+        # Method to change one value; only aggregates of that shard that read the column are invalidated
+        for shard in self.shards:
+            if row < shard.size:
+                shard.set(row, name, value)
+                break
+            row -= shard.size
+        self.version += 1
+
+    def __len__(self):
+        return sum(shard.size for shard in self.shards)  # Number of rows
+
+
+def census_test(predicate):
+    # Function to turn a filter into (test on a value, cache key): a range or collection of values, one value, or a
+    # callable (not cached)
+    if callable(predicate):
+        return predicate, None
+    if isinstance(predicate, range):
+        return predicate.__contains__, predicate
+    if isinstance(predicate, (set, frozenset, list, tuple)):
+        values = frozenset(predicate)
+        return values.__contains__, values
+    return (lambda value: value == predicate), ("=", predicate)
+
+
+def census_patient_row(patient):
+    # Function to get the analytics row of a patient
+    return patient.age, patient.gender, patient.medical_condition, patient.risk_level
+
+
+@functools.lru_cache(maxsize=None)
+def census_day(quarter_hour):
+    # Function to get the local date ordinal of a time given in quarter hours since the epoch (memoized; every
+    # time zone offset is a whole number of quarter hours)
+    return datetime.fromtimestamp(quarter_hour * 900).toordinal()
+
+
+def census_prescription_row(prescription, patient_row):
+    # Function to get the analytics row of a prescription (day is a date ordinal)
+    issued = prescription.issued
+    return prescription.medication, census_day(int(issued // 900)) if issued is not None else None, patient_row
+
+
+_census_source = None  # Patients shared with forked build workers
+
+
+def _census_part(start, stop, shard_rows):
+    # Function (run in a worker process) to build patient and prescription shards for a slice of the patients
+    patients = _census_source[start:stop]
+    patient_rows = [census_patient_row(patient) for patient in patients]
+    prescription_rows = [census_prescription_row(prescription, row)
+                         for row, patient in enumerate(patients, start) for prescription in patient.stored("prescriptions")]
+    tables = CensusAnalytics.TABLES
+    return ([ColumnShard(tables["patients"][0], (), patient_rows[i:i + shard_rows])
+             for i in range(0, len(patient_rows), shard_rows)],
+            [ColumnShard(tables["prescriptions"][0], tables["prescriptions"][1], prescription_rows[i:i + shard_rows])
+             for i in range(0, len(prescription_rows), shard_rows)])
+
+
+class CensusAnalytics:  # Defining a class for census reports over columnar snapshots of the system
+    # Snapshots are built on first use and then kept in step with writes; aggregates are cached per shard
+    TABLES = {  # Table -> (filterable columns, join links)
+        "patients": (("age", "gender", "medical_condition", "risk_level"), ()),
+        "prescriptions": (("medication", "day"), ("patient",)),
+        "appointments": (("doctor", "specialization", "day", "hour"), ()),
+    }
+
+    def __init__(self, system, shard_rows=ANALYTICS_SHARD_ROWS):
+        # Initializing the CensusAnalytics for a HospitalSystem
+        self.system = system
+        self.shard_rows = shard_rows
+        self.tables = None  # Table name -> ColumnarTable, once built
+        self.rows = {}  # Patient ID -> row in the patients table
+
+    def build(self, processes=None):
+        # Method to build the snapshots; with processes > 1 the patients are split across forked worker processes
+        global _census_source
+        patients = list(self.system.patients)
+        self.rows = {patient.id: row for row, patient in enumerate(patients)}
+        bounds = [(start, min(start + self.shard_rows, len(patients)))
+                  for start in range(0, len(patients), self.shard_rows)] or [(0, 0)]
+        _census_source = patients
+        try:
+            if processes and processes > 1 and len(bounds) > 1 and "fork" in multiprocessing.get_all_start_methods():
+                with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("fork")) as pool:
+                    parts = list(pool.map(_census_part, *zip(*bounds), itertools.repeat(self.shard_rows)))
+            else:
+                parts = [_census_part(start, stop, self.shard_rows) for start, stop in bounds]
+        finally:
+            _census_source = None
+        self.tables = {name: ColumnarTable(columns, links, self.shard_rows)
+                       for name, (columns, links) in self.TABLES.items()}
+        for patient_shards, prescription_shards in parts:
+            self.tables["patients"].shards.extend(patient_shards)
+            self.tables["prescriptions"].shards.extend(prescription_shards)
+        self.tables["appointments"].extend(
+            (doctor.id, doctor.specialization, parse_date(date).toordinal(), slot * SLOT_MINUTES // 60)
+            for doctor in self.system.doctors for date, day in doctor.schedule.items()
+            for slot in range(SLOTS_PER_DAY) if day.booked_mask >> slot & 1)
+        return self
+
+    def table(self, name):
+        # Method to get a snapshot table, building the snapshots on first use
+        if self.tables is None:
+            self.build()
+        return self.tables[name]
+
+    def patient_added(self, patient):
+        if self.tables is not None:
+            self.rows[patient.id] = self.tables["patients"].append(census_patient_row(patient))
+
+    def patient_changed(self, patient, field):
+        if self.tables is not None:
+            self.tables["patients"].set(self.rows[patient.id], field, getattr(patient, field))
+
+    def prescribed(self, patient, prescription):
+        if self.tables is not None:
+            self.tables["prescriptions"].append(census_prescription_row(prescription, self.rows[patient.id]))
+
+    def booked(self, doctor, date, time):
+        if self.tables is not None:
+            self.tables["appointments"].append((doctor.id, doctor.specialization, parse_date(date).toordinal(),
+                                                parse_time(time) * SLOT_MINUTES // 60))
+
+    def count(self, table, where=None, patients=None):
+        # Method to count rows matching where ({column: filter}); patients filters rows linked to matching patients
+        return sum(self._run(table, "count", None, where, patients,
+                             lambda shard, mask: mask.bit_count() if mask is not None else shard.size))
+
+    def group_by(self, table, column, where=None, patients=None):
+        # Method to count matching rows per value of a column
+        def compute(shard, mask):
+            return shard.columns[column].counts(mask.to_bytes(shard.size, "little") if mask is not None else None)
+        return sum(self._run(table, "group_by", column, where, patients, compute), Counter())
+
+    def histogram(self, table, column, bins, where=None, patients=None):
+        # Method to count matching rows per numeric band; bins are the lower edges, e.g. (0, 18, 40, 60, 80)
+        counts = [0] * len(bins)
+        for value, count in self.group_by(table, column, where, patients).items():
+            if value is not None and value >= bins[0]:
+                counts[bisect.bisect_right(bins, value) - 1] += count
+        labels = [f"{low}-{high - 1}" for low, high in zip(bins, bins[1:])] + [f"{bins[-1]}+"]
+        return list(zip(labels, counts))
+
+    def _run(self, name, op, column, where, patients, compute):
+        # Helper method to evaluate an aggregate on every shard of a table, reusing each shard's cached results
+        table = self.table(name)
+        tests = {field: census_test(predicate) for field, predicate in (where or {}).items()}
+        key = (op, column, tuple(sorted((field, test_key) for field, (_, test_key) in tests.items())))
+        read = frozenset(tests) | {column}
+        if any(test_key is None for _, test_key in tests.values()):
+            key = None
+        patient_tests = {field: census_test(predicate) for field, predicate in (patients or {}).items()}
+        if patient_tests:  # Join: a row matches when the patient it links to matches
+            patient_key = tuple(sorted((field, test_key) for field, (_, test_key) in patient_tests.items()))
+            if key is not None and all(test_key is not None for _, test_key in patient_tests.values()):
+                key += (patient_key, self.tables["patients"].version)  # Stale once patients change
+            else:
+                key = None
+        flags = []  # One flag byte per patient row, computed on the first cache miss
+
+        def evaluate(shard):
+            mask = self._mask(shard, tests) if tests else None
+            if patient_tests:
+                if not flags:
+                    flags.append(b"".join(self._mask(patient_shard, patient_tests).to_bytes(patient_shard.size,
+                                                                                            "little")
+                                          for patient_shard in self.tables["patients"].shards))
+                joined = int.from_bytes(bytes(map(flags[0].__getitem__, shard.links["patient"])), "little")
+                mask = joined if mask is None else mask & joined
+            return compute(shard, mask)
+        return [shard.aggregate(key, read, evaluate) for shard in table.shards]
+
+    def _mask(self, shard, tests):
+        # Helper method to AND the masks of several column filters on one shard
+        mask = None
+        for field, (test, _) in tests.items():
+            part = shard.columns[field].mask(test)
+            mask = part if mask is None else mask & part
+        return mask if mask is not None else int.from_bytes(b"\x01" * shard.size, "little")
+
+
+def read_patient_records(path, format=None):
+    # Generator function to stream patient records (dicts) from a CSV or JSONL file without loading the whole file
+    format = format or os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, newline="", encoding="utf-8") as file:
+        # A line or row that cannot be parsed is yielded as a ValueError, so the importer can skip it and go on
+        if format == "jsonl":
+            for line in file:
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as error:
+                        record = ValueError(f"invalid JSON: {error}")
+                    yield record
+        elif format == "csv":
+            for row in csv.DictReader(file):
+                # CSV cells are strings: lists are ";"-separated and vital signs are a JSON object
+                row["allergies"] = [item for item in (row.get("allergies") or "").split(";") if item]
+                row["previous_surgeries"] = [item for item in (row.get("previous_surgeries") or "").split(";") if item]
+                row["height"] = row.get("height") or None
+                row["weight"] = row.get("weight") or None
+                try:
+                    row["vital_signs"] = json.loads(row["vital_signs"]) if row.get("vital_signs") else {}
+                except ValueError as error:
+                    row = ValueError(f"vital_signs is not valid JSON: {error}")
+                yield row
+        else:
+            raise ValueError(f"Unsupported patient file format: {format}")
+
+
+def write_patient_records(path, records, format=None):
+    # Function to stream patient records (dicts) to a CSV or JSONL file; returns the number of records written
+    format = format or os.path.splitext(path)[1].lstrip(".").lower()
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if format == "jsonl":
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+                count += 1
+        elif format == "csv":
+            writer = csv.DictWriter(file, fieldnames=PATIENT_FIELDS)
+            writer.writeheader()
+            for record in records:
+                record = dict(record)
+                record["allergies"] = ";".join(record["allergies"])
+                record["previous_surgeries"] = ";".join(record["previous_surgeries"])
+                record["vital_signs"] = json.dumps(record["vital_signs"]) if record["vital_signs"] else ""
+                writer.writerow(record)
+                count += 1
+        else:
+            raise ValueError(f"Unsupported patient file format: {format}")
+    return count
+
+
+def validate_patient_record(record):
+    # Function to normalize one imported patient record in place; returns an error message or None if valid
+    if isinstance(record, ValueError):  # A line or row read_patient_records could not parse
+        return str(record)
+    if not isinstance(record, dict):
+        return "record is not an object"
+    if not record.get("id"):
+        return "missing patient ID"
+    for field in ("id", "name", "gender", "address", "phone_number", "email", "medical_condition"):
+        if record.get(field) is not None and not isinstance(record[field], str):
+            return f"{field} must be a string"
+    for field, kind, name in (("allergies", list, "a list"), ("previous_surgeries", list, "a list"),
+                              ("vital_signs", dict, "an object")):
+        if record.get(field) is not None and not isinstance(record[field], kind):
+            return f"{field} must be {name}"
+    try:
+        record["age"] = int(record["age"])
+        record["risk_level"] = int(record["risk_level"])
+    except (KeyError, TypeError, ValueError):
+        return "age and risk_level must be integers"
+    if not 0 <= record["age"] <= 150:
+        return f"age {record['age']} is outside 0-150"
+    if not 1 <= record["risk_level"] <= 5:
+        return f"risk_level {record['risk_level']} is outside 1-5"
+    return measurement_error(record.get("height"), record.get("weight"))
+
+
+class Storage:  # Defining a base class for storage backends (keeps nothing, so state is lost on exit)
+    persistent = False  # Whether the backend keeps anything; snapshots are not built for one that does not
+
+    def load(self):
+        # Method to load saved state; returns (snapshot state or None, list of logged operations after it)
+        return None, []
+
+    def encode(self, op):
+        # Method to convert an operation into the record append stores; raises if it cannot be stored
+        return op
+
+    def append(self, record):
+        # Method to log one state-changing operation, encoded by encode
+        pass
+
+    def flush(self):
+        # Method to make all logged operations durable
+        pass
+
+    def needs_snapshot(self, size=0):
+        # Method to check whether the log has grown enough to be compacted into a snapshot; size is the number of
+        # records a snapshot would write
+        return False
+
+    def snapshot(self, state, vitals=()):
+        # Method to save a full state snapshot and drop the log entries it covers; vitals holds the vital sign
+        # readings added since the previous snapshot, from VitalSignsStore.changes
+        pass
+
+    def load_vitals(self):
+        # Method to load the vital sign readings saved by snapshot, as arguments of VitalSignsStore.load_chunk
+        return []
+
+    def close(self):
+        # Method to flush and release the backend
+        pass
+
+
+class SQLiteStorage(Storage):  # Defining a storage backend with a write-ahead log and snapshots in a SQLite file
+    persistent = True
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, snapshot_every=10000):
+        # Initializing the SQLiteStorage and creating its tables if needed
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")  # Every committed batch is fsynced
+        self.connection.execute("CREATE TABLE IF NOT EXISTS log (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY, seq INTEGER, state TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS vitals (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "patient_id TEXT, metric TEXT, unit TEXT, times BLOB, vals BLOB)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS vitals_series ON vitals (patient_id, metric)")
+        self.batch_size = batch_size  # Number of operations committed together in one transaction
+        self.flush_interval = flush_interval  # Maximum seconds an operation waits in the batch (the menu and the
+        # service also flush when they go idle, so a batch is never left waiting for a next write)
+        self.snapshot_every = snapshot_every  # Minimum number of logged operations between snapshots
+        self.pending = []  # Serialized operations waiting for the next group commit
+        self.last_flush = time.monotonic()
+        self.logged = self.connection.execute("SELECT COUNT(*) FROM log").fetchone()[0]  # Log entries since snapshot
+
+    def load(self):
+        # Method to load the latest snapshot and the log entries written after it
+        row = self.connection.execute("SELECT seq, state FROM snapshot WHERE id = 1").fetchone()
+        seq, state = (row[0], json.loads(row[1])) if row else (0, None)
+        ops = [json.loads(op) for op, in
+               self.connection.execute("SELECT op FROM log WHERE seq > ? ORDER BY seq", (seq,))]
+        return state, ops
+
+    def load_vitals(self):
+        return self.connection.execute("SELECT patient_id, metric, unit, times, vals FROM vitals ORDER BY seq")
+
+    def encode(self, op):
+        return json.dumps(op)  # Operations are logged as JSON text
+
+    def append(self, record):
+        # Method to add an operation to the current batch, committing the batch when it is full or old enough
+        self.pending.append((record,))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # Method to commit all pending operations in a single transaction (group commit)
+        if self.pending:
+            with self.connection:
+                self.connection.executemany("INSERT INTO log (op) VALUES (?)", self.pending)
+            self.logged += len(self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def needs_snapshot(self, size=0):
+        # A snapshot costs time proportional to the state, so it waits for at least as many logged operations as
+        # records it would write; the cost then stays O(1) per operation however large the state grows
+        return self.logged + len(self.pending) >= max(self.snapshot_every, size)
+
+    def snapshot(self, state, vitals=()):
+        # Method to replace the snapshot with the given state, add the new vital sign readings as binary chunks and
+        # truncate the log they cover, in one transaction
+        self.flush()
+        with self.connection:
+            seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM log").fetchone()[0]
+            self.connection.execute("INSERT OR REPLACE INTO snapshot (id, seq, state) VALUES (1, ?, ?)",
+                                    (seq, json.dumps(state)))
+            for patient_id, metric, unit, times, values, replace in vitals:
+                if replace:
+                    self.connection.execute("DELETE FROM vitals WHERE patient_id = ? AND metric = ?",
+                                            (patient_id, metric))
+                self.connection.execute("INSERT INTO vitals (patient_id, metric, unit, times, vals) "
+                                        "VALUES (?, ?, ?, ?, ?)", (patient_id, metric, unit, times, values))
+            self.connection.execute("DELETE FROM log WHERE seq <= ?", (seq,))
+        self.logged = 0
+
+    def close(self):
+        if self.connection is not None:  # Closing twice is harmless
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+
+def patient_to_dict(patient):
+    # Function to convert a patient into JSON-compatible data
+    return {"id": patient.id, "name": patient.name, "age": patient.age, "gender": patient.gender,
+            "address": patient.address, "phone_number": patient.phone_number, "email": patient.email,
+            "medical_condition": patient.medical_condition, "risk_level": patient.risk_level,
+            "height": patient.height, "weight": patient.weight, "allergies": list(patient.stored("allergies")),
+            "previous_surgeries": list(patient.stored("previous_surgeries")),
+            "vital_signs": dict(patient.stored("vital_signs")),
+            "prescriptions": [prescription_to_dict(prescription) for prescription in patient.stored("prescriptions")]}
+
+
+def prescription_to_dict(prescription):
+    # Function to convert a prescription into JSON-compatible data
+    return {"medication": prescription.medication, "dosage": prescription.dosage,
+            "frequency": prescription.frequency, "instructions": prescription.instructions,
+            "issued": prescription.issued}
+
+
+class Result:  # Defining a class for the outcome of a HospitalSystem operation
+    __slots__ = ("ok", "kind", "data", "message")
+
+    def __init__(self, ok, kind, data=None, message=None):
+        self.ok = ok  # Whether the operation succeeded
+        self.kind = kind  # Operation or view name, used by formatters to pick a layout
+        self.data = data  # Object the operation produced or displays (patient, doctor, queue, ...)
+        self.message = message  # Human-readable confirmation or error message
+
+    def __bool__(self):
+        return self.ok  # Results can be tested like the booleans operations used to return
+
+
+class TextFormatter:  # Defining a formatter that renders results as the console text of the menu
+    def format(self, result):
+        # Method to convert a result into text, or None when there is nothing to show
+        render = getattr(self, "render_" + result.kind, None)
+        if result.ok and render is not None:
+            return "\n".join(render(result)) + "\n"
+        return result.message + "\n" if result.message else None
+
+    def render_patient(self, result):
+        patient = result.data
+        lines = ["\nPatient Information:", f"ID: {patient.id}", f"Name: {patient.name}", f"Age: {patient.age}",
+                 f"Gender: {patient.gender}", f"Address: {patient.address}", f"Phone Number: {patient.phone_number}",
+                 f"Email: {patient.email}", f"Medical Condition: {patient.medical_condition}",
+                 f"Risk Level: {patient.risk_level}", f"Height: {patient.height}", f"Weight: {patient.weight}",
+                 f"Allergies: {', '.join(patient.allergies)}",
+                 f"Previous Surgeries: {', '.join(patient.previous_surgeries)}", "Vital Signs:"]
+        lines.extend(f"{key}: {value}" for key, value in patient.vital_signs.items())
+        lines.append("Prescriptions:")
+        for prescription in patient.prescriptions:
+            lines.extend(self.prescription_lines(prescription))
+        return lines
+
+    def render_prescription(self, result):
+        return [result.message, "Prescription Details:"] + self.prescription_lines(result.data)
+
+    def prescription_lines(self, prescription):
+        return [f"Medication: {prescription.medication}", f"Dosage: {prescription.dosage}",
+                f"Frequency: {prescription.frequency}", f"Instructions: {prescription.instructions}"]
+
+    def render_doctor(self, result):
+        doctor = result.data
+        lines = ["\nDoctor Information:", f"ID: {doctor.id}", f"Name: {doctor.name}",
+                 f"Specialization: {doctor.specialization}", f"Address: {doctor.address}",
+                 f"Phone Number: {doctor.phone_number}", f"Email: {doctor.email}", "Schedule:"]
+        for date, times in doctor.schedule.items():  # Iterate through doctor's schedule
+            lines.append(f"Date: {date}, Available Times:")
+            lines.extend(times)
+        return lines
+
+    def render_doctor_schedule(self, result):
+        doctor = result.data
+        lines = [f"\nDoctor {doctor.name} Schedule:"]
+        for date, times in doctor.schedule.items():  # Iterate through doctor's schedule
+            lines.append(f"Date: {date}, Available Times:")
+            lines.extend(f"{idx}. {time}" for idx, time in enumerate(times, 1))  # Available times with indices
+        return lines
+
+    def render_calling_queue(self, result):
+        return ["\nCalling Queue:"] + self.queue_lines(result.data)
+
+    def render_arrival_queue(self, result):
+        return ["\nArrival Queue:"] + self.queue_lines(result.data)
+
+    def render_patient_search(self, result):
+        if not result.data:
+            return ["No matching patients found."]
+        return ["\nMatching Patients:"] + [
+            f"{idx}. Patient ID: {patient.id}, Name: {patient.name}, Phone Number: {patient.phone_number}, "
+            f"Email: {patient.email} (score {score:.2f})" for idx, (score, patient) in enumerate(result.data, 1)]
+
+    def render_census(self, result):
+        report = result.data
+        lines = ["\nCensus Report:", f"Patients: {report['patients']}", "Age Bands:"]
+        lines.extend(f"{band}: {count}" for band, count in report["age_bands"])
+        lines.append("Risk Levels:")
+        lines.extend(f"{risk}: {count}" for risk, count in report["risk_levels"])
+        lines.append("Top Conditions:")
+        lines.extend(f"{condition}: {count}" for condition, count in report["conditions"])
+        lines.append(f"Top Medications (last {report['days']} days):")
+        lines.extend(f"{medication}: {count}" for medication, count in report["top_medications"])
+        lines.append("Booked Appointments by Specialization:")
+        lines.extend(f"{specialization}: {count}" for specialization, count in report["specialization_load"])
+        return lines
+
+    def queue_lines(self, entries):
+        return [f"Patient ID: {patient.id}, Name: {patient.name}, Risk Level: {patient.risk_level}, "
+                f"Arrival Time: {arrival.strftime('%Y-%m-%d %H:%M:%S') if arrival else 'Unknown'}"
+                for patient, arrival in entries]
+
+
+class JSONFormatter:  # Defining a formatter that renders each result as one JSON line
+    def format(self, result):
+        return json.dumps({"ok": result.ok, "kind": result.kind, "message": result.message, "data": result.data},
+                          default=self.encode) + "\n"
+
+    def encode(self, value):
+        # Method to convert objects that json cannot serialize by itself
+        if isinstance(value, (Patient, PatientView)):
+            return patient_to_dict(value)
+        if isinstance(value, Prescription):
+            return prescription_to_dict(value)
+        if isinstance(value, Doctor):
+            return {"id": value.id, "name": value.name, "specialization": value.specialization,
+                    "address": value.address, "phone_number": value.phone_number, "email": value.email,
+                    "schedule": {date: list(times) for date, times in value.schedule.items()}}
+        if isinstance(value, Medication):
+            return {"code": value.code, "name": value.name, "dosage": value.dosage, "stock": value.stock}
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, (TriageQueue, tuple, set)):
+            return [{"id": patient.id, "name": patient.name, "risk_level": patient.risk_level} for patient in value]
+        return str(value)
+
+
+class QuietFormatter:  # Defining a formatter that shows nothing
+    def format(self, result):
+        return None
+
+
+class BufferedWriter:  # Defining a class that collects output and writes it to a stream in large chunks
+    def __init__(self, stream=None, buffer_size=0):
+        self.stream = stream  # Target stream; None means the current sys.stdout
+        self.buffer_size = buffer_size  # Characters collected before writing; 0 writes immediately
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("".join(self.buffer))
+            stream.flush()
+            self.buffer = []
+            self.size = 0
+
+
+class Presenter:  # Defining the presentation layer that formats operation results and writes them out
+    def __init__(self, formatter=None, writer=None, redisplay=True):
+        self.formatter = formatter if formatter else TextFormatter()  # How results are rendered
+        self.writer = writer if writer else BufferedWriter()  # Where rendered text goes
+        self.redisplay = redisplay  # Whether updates also show the updated patient or queue
+
+    def show(self, result):
+        # Method to render one result
+        text = self.formatter.format(result)
+        if text:
+            self.writer.write(text)
+
+    def say(self, text=""):
+        # Method to write a line of menu text regardless of the formatter
+        self.writer.write(text + "\n")
+
+    def flush(self):
+        self.writer.flush()
+
+
+def quiet_presenter():
+    # Function to create a presenter for batch jobs: no output and no implicit redisplays
+    return Presenter(QuietFormatter(), redisplay=False)
+
+
+class Instrumentation:  # Defining a class for opt-in latency, call count and collection size metrics
+    # Attaching wraps the listed methods of one HospitalSystem (and its presenter's output) with timers; detaching
+    # removes the wrappers again, so a system without instrumentation runs its methods with no extra work at all
+    def __init__(self, operations=INSTRUMENTED_OPERATIONS, buckets=LATENCY_BUCKETS):
+        # Initializing the Instrumentation
+        self.operations = operations
+        self.buckets = buckets
+        self.counts = {}  # Operation -> calls per latency bucket (the last one counts calls slower than all bounds)
+        self.totals = {}  # Operation -> [total nanoseconds, failed calls, profiled calls]
+        self.system = None  # The instrumented HospitalSystem
+        self.profiler = None  # cProfile.Profile of the sampled calls, once a capture was started
+        self.profile_calls = 0  # Number of calls still to be profiled
+        self.profile_every = 1  # Profile one call in this many
+        self.profiling = False  # Whether a sampled call is running under the profiler
+        self.seen = 0  # Calls seen since the capture started
+        self.server = None  # HTTP server of the metrics endpoint
+
+    def attach(self, system):
+        # Method to start timing the operations of a HospitalSystem
+        self.system = system
+        for name in self.operations:
+            setattr(system, name, self.wrap(name, getattr(system, name)))
+        system.presenter.show = self.wrap("render", system.presenter.show)  # Time of formatting and writing output
+
+    def detach(self):
+        # Method to stop timing; the collected metrics are kept
+        system, self.system = self.system, None
+        if system is not None:
+            for name in self.operations:
+                system.__dict__.pop(name, None)  # The class's own method is visible again
+            system.presenter.__dict__.pop("show", None)
+
+    def wrap(self, name, method):
+        # Method to make a timed version of a bound method
+        counts = self.counts.setdefault(name, [0] * (len(self.buckets) + 1))
+        totals = self.totals.setdefault(name, [0, 0, 0])
+        bounds = tuple(round(bound * 1e9) for bound in self.buckets)  # Integer nanoseconds compare fastest
+        bucket = bisect.bisect_left
+        perf_counter_ns = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            nested = self.profiling  # Called from a sampled call, so also running under the profiler
+            profiled = not nested and self.profile_calls and self._sample()
+            start = perf_counter_ns()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                totals[1] += 1
+                raise
+            finally:
+                elapsed = perf_counter_ns() - start
+                if profiled:
+                    self.profiler.disable()
+                    self.profiling = False
+                if profiled or nested:  # Counted apart: profiler overhead would distort the latency histogram
+                    totals[2] += 1
+                else:
+                    counts[bucket(bounds, elapsed)] += 1
+                    totals[0] += elapsed
+            if result.__class__ is Result and not result.ok:
+                totals[1] += 1
+            return result
+
+        return functools.update_wrapper(timed, method)
+
+    def start_profile(self, calls=1000, every=10):
+        # Method to profile every n-th operation call, for the next calls calls, adding to the current capture
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+        self.profile_calls = calls
+        self.profile_every = max(1, every)
+        self.seen = 0
+
+    def stop_profile(self):
+        # Method to stop sampling; the capture is kept for profile_report and dump_profile
+        self.profile_calls = 0
+
+    def clear_profile(self):
+        # Method to discard the captured profile
+        self.stop_profile()
+        self.profiler = None
+
+    def _sample(self):
+        # Helper method to decide whether the call starting now is profiled (calls nested in one already are)
+        if self.profiling:
+            return False
+        self.seen += 1
+        if self.seen % self.profile_every:
+            return False
+        self.profile_calls -= 1
+        try:
+            self.profiler.enable()
+        except ValueError:  # Another profiler is active in this interpreter
+            self.profile_calls = 0
+            return False
+        self.profiling = True
+        return True
+
+    def profile_report(self, sort="cumulative", limit=25):
+        # Method to get the captured profile as text, most expensive functions first
+        if self.profiler is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump_profile(self, path):
+        # Method to save the captured profile for pstats, snakeviz and similar tools
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+    def collection_sizes(self):
+        # Method to measure the main collections of the instrumented system
+        system = self.system
+        if system is None:
+            return {}
+        doctors = list(system.doctors.records.values())
+        days = [day for doctor in doctors for day in list(doctor.schedule.values())]
+        return {
+            "patients": len(system.patients),
+            "doctors": len(doctors),
+            "consultation_queue": len(system.consultation_queue),
+            "arrival_queue": len(system.arrival_queue),
+            "schedule_days": len(days),
+            "schedule_free_slots": sum(day.free_mask().bit_count() for day in days),
+            "medications": len(system.pharmacy),
+        }
+
+    def prometheus(self):
+        # Method to render all metrics in the Prometheus text exposition format
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        lines = ["# HELP hospital_operation_duration_seconds Latency of HospitalSystem operations.",
+                 "# TYPE hospital_operation_duration_seconds histogram"]
+        for name, counts in sorted(self.counts.items()):
+            label = f'operation="{name}"'
+            for bound, total in zip(bounds, itertools.accumulate(counts)):
+                lines.append(f'hospital_operation_duration_seconds_bucket{{{label},le="{bound}"}} {total}')
+            lines.append(f"hospital_operation_duration_seconds_sum{{{label}}} {self.totals[name][0] / 1e9!r}")
+            lines.append(f"hospital_operation_duration_seconds_count{{{label}}} {sum(counts)}")
+        lines += ["# HELP hospital_operation_failures_total Operations that failed or raised an error.",
+                  "# TYPE hospital_operation_failures_total counter"]
+        for name, (_, failures, _) in sorted(self.totals.items()):
+            lines.append(f'hospital_operation_failures_total{{operation="{name}"}} {failures}')
+        lines += ["# HELP hospital_operation_profiled_total Operations run under the sampling profiler, which are "
+                  "left out of the latency histogram.",
+                  "# TYPE hospital_operation_profiled_total counter"]
+        for name, (_, _, profiled) in sorted(self.totals.items()):
+            lines.append(f'hospital_operation_profiled_total{{operation="{name}"}} {profiled}')
+        lines += ["# HELP hospital_collection_size Number of items in a collection of the system.",
+                  "# TYPE hospital_collection_size gauge"]
+        for name, size in self.collection_sizes().items():
+            lines.append(f'hospital_collection_size{{collection="{name}"}} {size}')
+        if self.system is not None:
+            lines += ["# HELP hospital_queue_depth Patients waiting for consultation per risk level.",
+                      "# TYPE hospital_queue_depth gauge"]
+            for risk_level, depth in sorted(self.system.consultation_queue.depth.items()):
+                lines.append(f'hospital_queue_depth{{risk_level="{risk_level}"}} {depth}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Method to write the metrics to a file, replacing it atomically (e.g. for node_exporter's textfile collector)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def serve(self, host="127.0.0.1", port=9108):
+        # Method to serve the metrics at http://host:port/metrics from a background thread; returns the server
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not logged
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        # Method to stop the metrics endpoint
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class HospitalSystem:  # Defining a class for HospitalSystem
+    def __init__(self, storage=None, compact=False, presenter=None, sample_data=True, clock=time.time,
+                 instrumentation=None):
         # Initializing the HospitalSystem class with various attributes
-        self.patients = []  # List to store patients
-        self.doctors = []  # List to store doctors
-        self.consultation_queue = []  # List to store patients in consultation queue
+        # sample_data=False starts empty (no sample patients, doctors or messages); clock gives the current time
+        # in seconds since the epoch and can be replaced, e.g. by a simulation's clock; instrumentation, if given,
+        # times the operations from the start
+        self.clock = clock
+        self.presenter = presenter if presenter else Presenter()  # Renders operation results (console text by default)
+        self.patient_table = PatientTable() if compact else None  # Columnar patient storage in compact mode
+        self.patients = Registry(("phone_number", "email", "medical_condition"))  # Indexed registry of patients
+        self.doctors = Registry(("specialization",))  # Indexed registry of doctors
+        self.consultation_queue = TriageQueue()  # Priority queue of patients waiting for consultation
         self.arrival_queue = []  # List to store patients in arrival queue
+        self.queue_stats = QueueStats()  # Arrival and queue timestamps with live wait-time metrics
+        self.vitals = VitalSignsStore()  # History of vital sign readings
+        self.pharmacy = Pharmacy()  # Medication catalog and stock
+        self.analytics = CensusAnalytics(self)  # Columnar census reports, built on first use
+        self.search_index = PatientSearchIndex()  # Typo-tolerant search over patient names and contacts
+        self.storage = storage if storage else Storage()  # Backend that persists state changes
+        self.instrumentation = None  # Operation metrics, only collected when enabled
+        if instrumentation is not None:
+            self.instrument(instrumentation)
+        state, ops = self.storage.load()
+        if state is not None or ops:  # Recover saved state: load the snapshot, then replay the log written after it
+            if state is not None:
+                self._load_state(state)
+            for chunk in self.storage.load_vitals():  # Readings up to the snapshot; later ones are in the log
+                self.vitals.load_chunk(*chunk)
+            for op in ops:
+                self._apply(op)
+            return
+        if not sample_data:
+            return
         # Sample patient data
         self.add_patient("P001", "Abdualla Hassan", 35, "Male", "123 Main St", "555-123-4567", "Abdualla @example.com",
                          "Fever", 3, height="180 cm", weight="75 kg", allergies=["Penicillin"],
@@ -93,27 +2184,260 @@ class HospitalSystem:  # Defining a class for HospitalSystem
         self.add_doctor("D003", "Dr. Williams", "Pediatrician", "300 Hospital Rd", "555-555-6666",
                         "williams@example.com")
         # Sample doctor schedules
-        self.doctors[0].add_schedule("2024-04-01", "10:00 AM")
-        self.doctors[0].add_schedule("2024-04-01", "02:00 PM")
-        self.doctors[1].add_schedule("2024-04-01", "09:00 AM")
-        self.doctors[1].add_schedule("2024-04-01", "11:00 AM")
-        self.doctors[2].add_schedule("2024-04-01", "11:00 AM")
-        self.doctors[2].add_schedule("2024-04-01", "03:00 PM")
+        self.add_schedule("D001", "2024-04-01", "10:00 AM")
+        self.add_schedule("D001", "2024-04-01", "02:00 PM")
+        self.add_schedule("D002", "2024-04-01", "09:00 AM")
+        self.add_schedule("D002", "2024-04-01", "11:00 AM")
+        self.add_schedule("D003", "2024-04-01", "11:00 AM")
+        self.add_schedule("D003", "2024-04-01", "03:00 PM")
+
+    def _commit(self, op):
+        # Helper method to apply a state change and write it to the storage log
+        # _apply is not atomic: an operation failing part-way leaves memory changed but unlogged, so callers check
+        # every field of an operation before committing it. The operation is encoded for the log before it is
+        # applied, and appended once applied, so the log never holds an operation that would fail on replay
+        record = self.storage.encode(op)
+        result = self._apply(op)
+        self.storage.append(record)
+        if self.storage.needs_snapshot(len(self.patients)):
+            self.checkpoint()
+        return result
+
+    def _apply(self, op):
+        # Helper method to apply one logged operation to the in-memory state (used live and during recovery)
+        kind = op["op"]
+        if kind == "add_patient":
+            patient = self._new_patient(op["patient"])
+            self.patients.add(patient)  # Add patient to the patient registry
+            self.search_index.add(patient)  # Make the patient searchable
+            self.analytics.patient_added(patient)
+            self.arrival_queue.append(patient)  # Add patient to the arrival queue
+            self.queue_stats.arrived(patient.id, op.get("timestamp"))
+            self._enqueue(patient, op.get("timestamp"))  # Add patient to the consultation queue
+            return patient
+        if kind == "add_doctor":
+            doctor = Doctor(**op["doctor"])
+            self.doctors.add(doctor)  # Add doctor to the doctor registry
+            return doctor
+        if kind == "add_schedule":
+            self.doctors.get(op["doctor_id"]).add_schedule_range(op["date"], op["time"], op["count"])
+        elif kind == "book":
+            doctor = self.doctors.get(op["doctor_id"])
+            doctor.book(op["date"], op["time"])  # Mark the slot as booked
+            self.analytics.booked(doctor, op["date"], op["time"])
+            self._enqueue(self.patients.get(op["patient_id"]), op.get("timestamp"))  # Add patient to consultation queue
+        elif kind == "enqueue":
+            self._enqueue(self.patients.get(op["patient_id"]), op.get("timestamp"))  # Add patient to consultation queue
+        elif kind == "dequeue":
+            self._dequeue(self.patients.get(op["patient_id"]), op.get("timestamp"), op.get("called", False))
+        elif kind == "update_risk":
+            patient = self.patients.update(op["patient_id"], risk_level=op["risk_level"])
+            self.analytics.patient_changed(patient, "risk_level")
+            if patient in self.consultation_queue:
+                self.consultation_queue.reprioritize(patient)  # Move the patient to their new position
+        elif kind == "update_patient":
+            patient = self.patients.get(op["patient_id"])
+            for key, value in op["vital_signs"].items():  # Update vital signs
+                patient.add_vital_sign(key, value)
+                self.vitals.record(patient.id, key, value, op.get("timestamp"))  # Keep the reading in the history
+            self.patients.update(patient.id, weight=op["weight"])  # Update patient's weight
+            self.search_index.add(patient)  # Re-index only if the searchable text changed
+        elif kind == "vital":
+            self.patients.get(op["patient_id"]).add_vital_sign(op["key"], op["value"])
+            return self.vitals.record(op["patient_id"], op["key"], op["value"], op.get("timestamp"))
+        elif kind == "prescription":
+            patient = self.patients.get(op["patient_id"])
+            prescription = Prescription(issued=op.get("timestamp"), **op["prescription"])
+            patient.add_prescription(prescription)  # Add prescription to patient
+            self.analytics.prescribed(patient, prescription)
+            if "code" in op:  # Operations logged before the pharmacy catalog existed did not track stock
+                self.pharmacy.dispense(op["code"], op["quantity"])
+            self._dequeue(patient, op.get("timestamp"))  # Remove patient from consultation queue
+        elif kind == "dispense":
+            for patient_id, code, quantity, frequency, instructions in op["orders"]:
+                patient = self.patients.get(patient_id)
+                medication = self.pharmacy.medications[code]
+                prescription = Prescription(medication.name, medication.dosage, frequency, instructions,
+                                            op["timestamp"])
+                patient.add_prescription(prescription)
+                self.analytics.prescribed(patient, prescription)
+                self.pharmacy.dispense(code, quantity)
+                self._dequeue(patient, op["timestamp"])
+        elif kind == "add_medication":
+            medication = Medication(**op["medication"])
+            self.pharmacy.add(medication)
+            return medication
+        elif kind == "restock":
+            self.pharmacy.restock(op["code"], op["quantity"])
+        else:
+            raise ValueError(f"Unknown operation: {kind}")
+
+    def _enqueue(self, patient, timestamp=None):
+        # Helper method to add a patient to the consultation queue, timing their wait from the first entry
+        if patient not in self.consultation_queue:
+            self.queue_stats.enqueued(patient.id, timestamp)
+        self.consultation_queue.push(patient)
+
+    def _dequeue(self, patient, timestamp=None, called=False):
+        # Helper method to remove a patient from the consultation queue if queued
+        if patient in self.consultation_queue:
+            self.consultation_queue.remove(patient)
+            self.queue_stats.dequeued(patient.id, timestamp, called)
+
+    def _new_patient(self, fields):
+        # Helper method to create a patient record, as a PatientTable row in compact mode
+        if self.patient_table is not None:
+            return self.patient_table.append(**fields)
+        return Patient(**fields)
+
+    def checkpoint(self):
+        # Method to write a compacted snapshot of the full state so recovery does not replay the whole history; the
+        # vital sign history is not part of it but saved beside it, only the readings added since the last snapshot
+        if self.storage.persistent:  # Dumping the state is O(n), so it is skipped when the backend would discard it
+            self.storage.snapshot(self._dump_state(), self.vitals.changes())
+
+    def close(self):
+        # Method to flush pending output and writes and close the storage backend (closing twice is harmless)
+        self.presenter.flush()
+        self.storage.close()
+
+    def instrument(self, instrumentation=None):
+        # Method to enable operation metrics; returns the Instrumentation collecting them
+        if self.instrumentation is None:
+            self.instrumentation = instrumentation if instrumentation else Instrumentation()
+            self.instrumentation.attach(self)
+        return self.instrumentation
+
+    def uninstrument(self):
+        # Method to disable operation metrics, removing all timing overhead; returns the collected Instrumentation
+        instrumentation, self.instrumentation = self.instrumentation, None
+        if instrumentation is not None:
+            instrumentation.detach()
+        return instrumentation
+
+    def _dump_state(self):
+        # Helper method to convert the whole system state into JSON-compatible data
+        return {
+            "patients": [patient_to_dict(patient) for patient in self.patients],
+            "doctors": [{"id": doctor.id, "name": doctor.name, "specialization": doctor.specialization,
+                         "address": doctor.address, "phone_number": doctor.phone_number, "email": doctor.email,
+                         "schedule": {date: [day.open_mask, day.booked_mask] for date, day in doctor.schedule.items()}}
+                        for doctor in self.doctors],
+            "consultation_queue": [patient.id for patient in self.consultation_queue],  # In calling order
+            "arrival_queue": [patient.id for patient in self.arrival_queue],
+            "queue_stats": self.queue_stats.dump(),
+            "pharmacy": self.pharmacy.dump(),
+        }
+
+    def _load_state(self, state):
+        # Helper method to rebuild the system state from a snapshot made by _dump_state
+        for data in state["patients"]:
+            prescriptions = data.pop("prescriptions")
+            patient = self._new_patient(data)
+            for prescription in prescriptions:
+                patient.add_prescription(Prescription(**prescription))
+            self.patients.add(patient)
+            self.search_index.add(patient)
+        for data in state["doctors"]:
+            schedule = data.pop("schedule")
+            doctor = Doctor(**data)
+            for date, (open_mask, booked_mask) in schedule.items():
+                day = doctor.schedule[date] = DaySchedule()
+                day.open_mask, day.booked_mask = open_mask, booked_mask
+            doctor.dates = sorted(schedule)
+            self.doctors.add(doctor)
+        for patient_id in state["consultation_queue"]:  # Re-pushing in calling order keeps the same order
+            self.consultation_queue.push(self.patients.get(patient_id))
+        self.arrival_queue = [self.patients.get(patient_id) for patient_id in state["arrival_queue"]]
+        self.vitals.load(state.get("vitals", {}))
+        if "queue_stats" in state:
+            self.queue_stats.load(state["queue_stats"])
+        if "pharmacy" in state:
+            self.pharmacy.load(state["pharmacy"])
 
     def add_patient(self, id, name, age, gender, address, phone_number, email, medical_condition, risk_level,
                     height=None, weight=None, allergies=None, previous_surgeries=None, vital_signs=None):
         # Method to add a new patient to the system
-        patient = Patient(id, name, age, gender, address, phone_number, email, medical_condition, risk_level, height,
-                          weight, allergies, previous_surgeries, vital_signs)
-        self.patients.append(patient)  # Add patient to the list of patients
-        self.arrival_queue.append(patient)  # Add patient to the arrival queue
-        self.consultation_queue.append(patient)  # Add patient to the consultation queue
-        print(f"New patient {name} added successfully to the system.")  # Print confirmation message
+        if id in self.patients:  # Reject duplicate patient IDs at insert time
+            return self._emit(Result(False, "add_patient", message=f"Patient with ID {id} already exists."))
+        fields = {"id": id, "name": name, "age": age, "gender": gender, "address": address,
+                  "phone_number": phone_number, "email": email, "medical_condition": medical_condition,
+                  "risk_level": risk_level, "height": height, "weight": weight, "allergies": allergies,
+                  "previous_surgeries": previous_surgeries, "vital_signs": vital_signs}
+        error = validate_patient_record(fields)  # Same checks as imports, before anything is changed
+        if error:
+            return self._emit(Result(False, "add_patient", message=f"Invalid patient data: {error}."))
+        patient = self._commit({"op": "add_patient", "timestamp": self.clock(), "patient": fields})
+        return self._emit(Result(True, "add_patient", patient,
+                                 f"New patient {name} added successfully to the system."))  # Confirmation message
 
     def add_doctor(self, id, name, specialization, address, phone_number, email):
         # Method to add a new doctor to the system
-        doctor = Doctor(id, name, specialization, address, phone_number, email)
-        self.doctors.append(doctor)  # Add doctor to the list of doctors
+        if id in self.doctors:  # Reject duplicate doctor IDs at insert time
+            return self._emit(Result(False, "add_doctor", message=f"Doctor with ID {id} already exists."))
+        doctor = self._commit({"op": "add_doctor", "doctor": {
+            "id": id, "name": name, "specialization": specialization, "address": address,
+            "phone_number": phone_number, "email": email}})
+        return Result(True, "add_doctor", doctor)  # Adding a doctor is silent, as before
+
+    def add_schedule(self, doctor_id, date, time, count=1):
+        # Method to open count consecutive appointment slots for a doctor starting at the given time
+        if doctor_id not in self.doctors:
+            return self._emit(Result(False, "add_schedule", message="Doctor not found."))
+        self._commit({"op": "add_schedule", "doctor_id": doctor_id, "date": date, "time": time, "count": count})
+        return Result(True, "add_schedule")
+
+    def import_patients(self, path, format=None, enqueue=True, batch_size=10000, max_errors=100):
+        # Method to bulk-load patients from a CSV or JSONL file
+        # Records are streamed and inserted in batches; secondary indexes are built once at the end
+        imported = skipped = 0
+        timestamp = self.clock()  # One arrival time for the whole import
+        errors = []  # First max_errors problems as (record number, message)
+        records = read_patient_records(path, format)
+        number = 0
+        queued = []  # Patients to enqueue, added to the calling queue in one step at the end
+        try:
+            while True:
+                batch = []
+                start = number
+                for record in itertools.islice(records, batch_size):
+                    number += 1
+                    error = validate_patient_record(record)
+                    if error is None and record["id"] in self.patients:
+                        error = f"duplicate patient ID {record['id']}"
+                    if error is None:
+                        patient = self._new_patient({field: record.get(field) for field in PATIENT_FIELDS})
+                        self.patients.add(patient, index=False)  # Secondary indexes are built once at the end
+                        self.search_index.add(patient)
+                        self.analytics.patient_added(patient)
+                        self.queue_stats.arrived(patient.id, timestamp)
+                        batch.append(patient)
+                    else:
+                        skipped += 1
+                        if len(errors) < max_errors:
+                            errors.append((number, error))
+                if enqueue:
+                    self.arrival_queue.extend(batch)  # Add patients to the arrival queue
+                    for patient in batch:
+                        if patient not in self.consultation_queue:
+                            self.queue_stats.enqueued(patient.id, timestamp)
+                    queued.extend(batch)
+                imported += len(batch)
+                if number - start < batch_size:  # The file is exhausted
+                    break
+        finally:  # Queue, index and persist the patients added so far even if reading the file failed
+            self.consultation_queue.extend(queued)  # Add patients to the consultation queue, heapifying once
+            self.patients.rebuild_indexes()
+            self.checkpoint()  # Persist the import as one snapshot rather than one log entry per patient
+        return self._emit(Result(True, "import_patients", {"imported": imported, "skipped": skipped, "errors": errors},
+                                 f"Imported {imported} patients from {path} ({skipped} skipped)."))  # One summary
+
+    def export_patients(self, path, format=None):
+        # Method to stream all patients to a CSV or JSONL file
+        records = ({field: value for field, value in patient_to_dict(patient).items() if field in PATIENT_FIELDS}
+                   for patient in self.patients)
+        count = write_patient_records(path, records, format)
+        return self._emit(Result(True, "export_patients", count, f"Exported {count} patients to {path}."))
 
     def schedule_appointment(self, patient_id, doctor_id, date, time_idx):
         # Method to schedule an appointment between a patient and a doctor
@@ -122,281 +2446,635 @@ class HospitalSystem:  # Defining a class for HospitalSystem
         if patient and doctor:  # If both patient and doctor exist
             available_times = doctor.get_available_times(
                 date)  # Get available times for the doctor on the specified date
-            if available_times and time_idx <= len(
+            if available_times and 1 <= time_idx <= len(
                     available_times):  # If there are available times and the selected index is valid
                 time = available_times[time_idx - 1][0]  # Get the selected time
-                doctor.add_schedule(date, time)  # Add appointment to doctor's schedule
-                # Add patient to consultation queue
-                self.consultation_queue.append(patient)
-                print(f"Appointment scheduled successfully for {patient.name} with {doctor.name} on {date} at {time}.")
-            else:
-                print("Invalid time selection.")  # Print error message if time selection is invalid
+                return self.book_appointment(patient_id, doctor_id, date, time)
+            result = Result(False, "book_appointment", message="Invalid time selection.")
         else:
-            print("Patient or doctor not found.")  # Print error message if patient or doctor not found
+            result = Result(False, "book_appointment", message="Patient or doctor not found.")
+        return self._emit(result)
+
+    def book_appointment(self, patient_id, doctor_id, date, time):
+        # Method to book an appointment at a specific date and time
+        patient = self.search_patient(patient_id)  # Find patient by ID
+        doctor = self.search_doctor(doctor_id)  # Find doctor by ID
+        if not (patient and doctor):
+            return self._emit(Result(False, "book_appointment", message="Patient or doctor not found."))
+        if not doctor.is_available(date, time):  # Check the slot is still free
+            return self._emit(Result(False, "book_appointment",
+                                     message=f"{doctor.name} is not available on {date} at {time}."))
+        self._commit({"op": "book", "patient_id": patient_id, "doctor_id": doctor_id, "date": date, "time": time,
+                      "timestamp": self.clock()})
+        return self._emit(Result(True, "book_appointment",
+                                 {"patient_id": patient_id, "doctor_id": doctor_id, "date": date, "time": time},
+                                 f"Appointment scheduled successfully for {patient.name} with {doctor.name} "
+                                 f"on {date} at {time}."))
+
+    def find_earliest_slot(self, specialization, after=None, limit=5):
+        # Method to find the limit soonest free slots across all doctors with a specialization
+        # Each doctor yields its free slots in time order, so a k-way heap merge only looks at as many slots as needed
+        merged = heapq.merge(*(doctor.free_slot_times(after) for doctor in self.find_doctors(specialization)))
+        return [(when, doctor) for when, _, doctor in itertools.islice(merged, limit)]  # List of (datetime, doctor)
 
     def display_calling_queue(self):
         # Method to display the calling queue (patients waiting for consultation) sorted by risk level
-        print("\nCalling Queue:")
-        sorted_queue = sorted(self.consultation_queue, key=lambda x: x.risk_level,
-                              reverse=True)  # Sort the queue by risk level
-        for patient in sorted_queue:
-            print(
-                f"Patient ID: {patient.id}, Name: {patient.name}, Risk Level: {patient.risk_level}, Arrival Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return self._emit(Result(True, "calling_queue", self.queue_entries(self.consultation_queue)))  # By risk level
 
     def remove_patient_from_queue(self, patient_id):
         # Method to remove a patient from the consultation queue
         patient = self.search_patient(patient_id)  # Find patient by ID
         if patient:
             if patient in self.consultation_queue:  # If patient is in consultation queue
-                self.consultation_queue.remove(patient)  # Remove patient from the consultation queue
-                print(f"{patient.name} removed from the consultation queue.")  # Print confirmation message
-                self.display_calling_queue()  # Display updated calling queue
-            else:
-                print(
-                    f"{patient.name} is not in the consultation queue.")  # Print error message if patient not in queue
-        else:
-            print("Patient not found.")  # Print error message if patient not found
+                self._commit({"op": "dequeue", "patient_id": patient_id,
+                              "timestamp": self.clock()})  # Remove patient from the consultation queue
+                result = self._emit(Result(True, "remove_from_queue", patient,
+                                           f"{patient.name} removed from the consultation queue."))
+                if self.presenter.redisplay:
+                    self.display_calling_queue()  # Display updated calling queue
+                return result
+            return self._emit(Result(False, "remove_from_queue", patient,
+                                     f"{patient.name} is not in the consultation queue."))
+        return self._emit(Result(False, "remove_from_queue", message="Patient not found."))
+
+    def add_to_queue(self, patient_id):
+        # Method to put a registered patient back into the consultation queue
+        patient = self.search_patient(patient_id)  # Find patient by ID
+        if patient:
+            self._commit({"op": "enqueue", "patient_id": patient_id,
+                          "timestamp": self.clock()})  # Add patient to the consultation queue
+            return self._emit(Result(True, "add_to_queue", patient, f"{patient.name} added to the consultation queue."))
+        return self._emit(Result(False, "add_to_queue", message="Patient not found."))
+
+    def call_next_patient(self):
+        # Method to call the highest-risk patient from the consultation queue
+        if not self.consultation_queue:
+            return self._emit(Result(False, "call_next_patient", message="The consultation queue is empty."))
+        patient = next(self.consultation_queue.peek(1))  # Find the next patient in the queue
+        self._commit({"op": "dequeue", "patient_id": patient.id, "timestamp": self.clock(),
+                      "called": True})  # Remove the patient from the queue
+        return self._emit(Result(True, "call_next_patient", patient,
+                                 f"Calling {patient.name} (Risk Level: {patient.risk_level})."))
+
+    def update_risk_level(self, patient_id, risk_level):
+        # Method to change a patient's risk level and re-prioritize them in the consultation queue
+        patient = self.search_patient(patient_id)  # Find patient by ID
+        if patient and not (isinstance(risk_level, int) and not isinstance(risk_level, bool) and 1 <= risk_level <= 5):
+            return self._emit(Result(False, "update_risk_level", message=f"Invalid risk level: {risk_level!r}."))
+        if patient:
+            self._commit({"op": "update_risk", "patient_id": patient_id, "risk_level": risk_level})
+            return self._emit(Result(True, "update_risk_level", patient,
+                                     f"{patient.name}'s risk level updated to {risk_level}."))
+        return self._emit(Result(False, "update_risk_level", message="Patient not found."))
 
     def display_patient_info(self, patient_id):
         # Method to display information of a specific patient
         patient = self.search_patient(patient_id)  # Find patient by ID
         if patient:
-            print("\nPatient Information:")
-            # Print various details of the patient
-            print(f"ID: {patient.id}")
-            print(f"Name: {patient.name}")
-            print(f"Age: {patient.age}")
-            print(f"Gender: {patient.gender}")
-            print(f"Address: {patient.address}")
-            print(f"Phone Number: {patient.phone_number}")
-            print(f"Email: {patient.email}")
-            print(f"Medical Condition: {patient.medical_condition}")
-            print(f"Risk Level: {patient.risk_level}")
-            print(f"Height: {patient.height}")
-            print(f"Weight: {patient.weight}")
-            print(f"Allergies: {', '.join(patient.allergies)}")
-            print(f"Previous Surgeries: {', '.join(patient.previous_surgeries)}")
-            print("Vital Signs:")
-            for key, value in patient.vital_signs.items():
-                print(f"{key}: {value}")
-            print("Prescriptions:")
-            for prescription in patient.prescriptions:
-                print(f"Medication: {prescription.medication}")
-                print(f"Dosage: {prescription.dosage}")
-                print(f"Frequency: {prescription.frequency}")
-                print(f"Instructions: {prescription.instructions}")
-        else:
-            print("Patient not found.")  # Print error message if patient not found
+            return self._emit(Result(True, "patient", patient))
+        return self._emit(Result(False, "patient", message="Patient not found."))
 
     def update_patient_info(self, patient_id, vital_signs, weight):
         # Method to update information of a specific patient
         patient = self.search_patient(patient_id)  # Find patient by ID
-        if patient:
-            for key, value in vital_signs.items():  # Update vital signs
-                patient.add_vital_sign(key, value)
-            patient.weight = weight  # Update patient's weight
-            print(f"{patient.name}'s information updated successfully.")  # Print confirmation message
-            self.display_patient_info(patient_id)  # Display updated patient information
+        error = measurement_error(weight=weight)
+        if not isinstance(vital_signs, dict):
+            error = "vital signs must map names to readings"
         else:
-            print("Patient not found.")  # Print error message if patient not found
+            for key, value in vital_signs.items():
+                error = error or vital_sign_error(key, value)
+        if patient and error:  # Check before anything is changed
+            return self._emit(Result(False, "update_patient", message=f"Invalid patient data: {error}."))
+        if patient:
+            self._commit({"op": "update_patient", "patient_id": patient_id, "vital_signs": vital_signs,
+                          "weight": weight, "timestamp": self.clock()})  # Update vital signs and weight
+            result = self._emit(Result(True, "update_patient", patient,
+                                       f"{patient.name}'s information updated successfully."))
+            if self.presenter.redisplay:
+                self.display_patient_info(patient_id)  # Display updated patient information
+            return result
+        return self._emit(Result(False, "update_patient", message="Patient not found."))
 
-    def purchase_prescription(self, patient_id):
-        # Method for purchasing prescription for a patient
+    def record_vital_sign(self, patient_id, key, value, timestamp=None):
+        # Method to store a monitored vital sign reading; the result data lists the alerts it raised
+        if patient_id not in self.patients:
+            return self._emit(Result(False, "record_vital_sign", [], "Patient not found."))
+        error = vital_sign_error(key, value)  # Checked first: the reading changes the patient before the history
+        if error is None and timestamp is not None and not isinstance(timestamp, (int, float)):
+            error = f"timestamp {timestamp!r} must be a number of seconds"
+        if error:
+            return self._emit(Result(False, "record_vital_sign", [], f"Invalid vital sign: {error}."))
+        timestamp = self.clock() if timestamp is None else timestamp
+        alerts = self._commit({"op": "vital", "patient_id": patient_id, "key": key, "value": value,
+                               "timestamp": timestamp})
+        return Result(True, "record_vital_sign", alerts)  # Readings arrive continuously, so they are not displayed
+
+    def vital_sign_summary(self, patient_id, metric, minutes=60):
+        # Method to get min, max, mean and trend of a vital sign over the last minutes
+        return self.vitals.aggregate(patient_id, metric, minutes, now=self.clock())
+
+    def purchase_prescription(self, patient_id, choice, quantity=1, frequency="Once daily",
+                              instructions="After meal"):
+        # Method for purchasing prescription for a patient; choice is a medication code, name or catalog number
         patient = self.search_patient(patient_id)  # Find patient by ID
-        if patient:
-            print("Prescription Purchase:")
-            print("1. Aspirin")
-            print("2. Ibuprofen")
-            print("3. Paracetamol")
-            print("4. Antibiotics")
-            print("5. Antihistamines")
-            choice = input("Enter your choice: ")  # Prompt user to enter choice
-            medications = {
-                '1': ("Aspirin", "325 mg"),
-                '2': ("Ibuprofen", "200 mg"),
-                '3': ("Paracetamol", "500 mg"),
-                '4': ("Antibiotics", "500 mg"),
-                '5': ("Antihistamines", "10 mg")
-            }
-            if choice in medications:  # If choice is valid
-                medication, dosage = medications[choice]  # Get medication and dosage
-                frequency = "Once daily"  # Set frequency of medication
-                instructions = "After meal"  # Set instructions for medication
-                prescription = Prescription(medication, dosage, frequency, instructions)  # Create prescription object
-                patient.add_prescription(prescription)  # Add prescription to patient
-                self.consultation_queue.remove(patient)  # Remove patient from consultation queue
-                print(
-                    f"{medication} prescription purchased successfully for {patient.name}.")  # Print confirmation message
-                print("Prescription Details:")
-                # Print details of purchased prescription
-                print(f"Medication: {medication}")
-                print(f"Dosage: {dosage}")
-                print(f"Frequency: {frequency}")
-                print(f"Instructions: {instructions}")
+        if not patient:
+            return self._emit(Result(False, "prescription", message="Patient not found."))
+        medication = self.pharmacy.find(choice) if choice else None
+        if medication is None:  # If choice is invalid
+            return self._emit(Result(False, "prescription", message="Invalid choice."))
+        if not valid_quantity(quantity):
+            return self._emit(Result(False, "prescription", message=f"Invalid quantity: {quantity!r}."))
+        allergies = self.pharmacy.allergies_against(patient, medication)
+        if allergies:
+            return self._emit(Result(False, "prescription", message=f"{medication.name} is contraindicated for "
+                                                                    f"{patient.name} (allergy: {', '.join(allergies)})."))
+        if not self.pharmacy.reserve(medication.code, quantity):
+            return self._emit(Result(False, "prescription", message=f"{medication.name} is out of stock."))
+        try:
+            self._commit({"op": "prescription", "patient_id": patient_id, "timestamp": self.clock(),
+                          "code": medication.code, "quantity": quantity, "prescription": {
+                              "medication": medication.name, "dosage": medication.dosage, "frequency": frequency,
+                              "instructions": instructions}})
+        finally:
+            self.pharmacy.release(medication.code, quantity)
+        return self._emit(Result(True, "prescription", patient.prescriptions[-1],
+                                 f"{medication.name} prescription purchased successfully for {patient.name}."))
+
+    def dispense_prescriptions(self, orders):
+        # Method to dispense prescriptions for many patients in one call (e.g. a nightly ward round)
+        # Each order is a dict with patient_id and medication (code or name), and optionally quantity, frequency
+        # and instructions; orders are checked and stock is reserved in one pass, then all are logged as one entry
+        accepted, rejected = [], []  # rejected holds (order number, patient ID, reason)
+        for number, order in enumerate(orders):
+            if not isinstance(order, dict):
+                rejected.append((number, None, "Order must be an object with patient_id and medication."))
+                continue
+            patient_id = order.get("patient_id")
+            patient = self.patients.get(patient_id)
+            medication = self.pharmacy.find(order.get("medication", ""))
+            quantity = order.get("quantity", 1)
+            allergies = self.pharmacy.allergies_against(patient, medication) if patient and medication else EMPTY
+            if patient is None:
+                rejected.append((number, patient_id, "Patient not found."))
+            elif medication is None:
+                rejected.append((number, patient_id, f"Unknown medication: {order.get('medication')}"))
+            elif not valid_quantity(quantity):
+                rejected.append((number, patient_id, f"Invalid quantity: {quantity!r}."))
+            elif allergies:
+                rejected.append((number, patient_id,
+                                 f"{medication.name} is contraindicated (allergy: {', '.join(allergies)})."))
             else:
-                print("Invalid choice.")  # Print error message for invalid choice
-        else:
-            print("Patient not found.")  # Print error message if patient not found
+                accepted.append((number, [patient_id, medication.code, quantity,
+                                          order.get("frequency", "Once daily"),
+                                          order.get("instructions", "After meal")]))
+        reserved = self.pharmacy.reserve_many((entry[1], entry[2]) for _, entry in accepted)
+        dispensed = []
+        for (number, entry), ok in zip(accepted, reserved):
+            if ok:
+                dispensed.append(entry)
+            else:
+                rejected.append((number, entry[0], f"{self.pharmacy.medications[entry[1]].name} is out of stock."))
+        rejected.sort()
+        try:
+            if dispensed:
+                self._commit({"op": "dispense", "timestamp": self.clock(), "orders": dispensed})
+        finally:
+            for _, code, quantity, _, _ in dispensed:
+                self.pharmacy.release(code, quantity)
+        return self._emit(Result(True, "dispense_prescriptions", {"dispensed": len(dispensed), "rejected": rejected},
+                                 f"Dispensed {len(dispensed)} prescriptions ({len(rejected)} rejected)."))
+
+    def add_medication(self, code, name, dosage, stock=0, contraindications=()):
+        # Method to add a medication to the pharmacy catalog, or replace the one with the same code
+        medication = self._commit({"op": "add_medication", "medication": {
+            "code": code, "name": name, "dosage": dosage, "stock": stock,
+            "contraindications": list(contraindications)}})
+        return Result(True, "add_medication", medication)  # Adding a medication is silent, like adding a doctor
+
+    def restock_medication(self, code, quantity):
+        # Method to add units to a medication's stock
+        if code not in self.pharmacy.medications:
+            return self._emit(Result(False, "restock", message="Medication not found."))
+        if not valid_quantity(quantity):
+            return self._emit(Result(False, "restock", message=f"Invalid quantity: {quantity!r}."))
+        self._commit({"op": "restock", "code": code, "quantity": quantity})
+        medication = self.pharmacy.medications[code]
+        return self._emit(Result(True, "restock", medication,
+                                 f"{medication.name} restocked: {medication.stock} units in stock."))
 
     def search_patient(self, patient_id):
         # Method to search for a patient by ID
-        for patient in self.patients:  # Iterate through list of patients
-            if patient.id == patient_id:  # If patient ID matches
-                return patient  # Return the patient object
-        return None  # Return None if patient not found
+        return self.patients.get(patient_id)  # Return the patient object or None if not found
 
     def search_doctor(self, doctor_id):
         # Method to search for a doctor by ID
-        for doctor in self.doctors:  # Iterate through list of doctors
-            if doctor.id == doctor_id:  # If doctor ID matches
-                return doctor  # Return the doctor object
-        return None  # Return None if doctor not found
+        return self.doctors.get(doctor_id)  # Return the doctor object or None if not found
+
+    def find_patients(self, field, value):
+        # Method to find patients by phone_number, email or medical_condition
+        return self.patients.find(field, value)  # Return list of matching patients
+
+    def search_patients(self, query, limit=10, prefix=True):
+        # Method to find patients by approximate name, phone number or email, best matches first
+        matches = [(score, self.patients.get(patient_id))
+                   for score, patient_id in self.search_index.search(query, limit, prefix)]
+        return self._emit(Result(True, "patient_search", matches))
+
+    def census_report(self, days=7, top=5):
+        # Method to report the patient census, top medications over the last days and appointment load
+        analytics = self.analytics
+        today = datetime.fromtimestamp(self.clock()).toordinal()
+        report = {
+            "patients": analytics.count("patients"),
+            "age_bands": analytics.histogram("patients", "age", (0, 18, 40, 60, 80)),
+            "risk_levels": sorted(analytics.group_by("patients", "risk_level").items(), reverse=True),
+            "conditions": analytics.group_by("patients", "medical_condition").most_common(top),
+            "days": days,
+            "top_medications": analytics.group_by("prescriptions", "medication",
+                                                  {"day": range(today - days + 1, today + 1)}).most_common(top),
+            "specialization_load": analytics.group_by("appointments", "specialization").most_common(),
+        }
+        return self._emit(Result(True, "census", report))
+
+    def find_doctors(self, specialization):
+        # Method to find doctors by specialization
+        return self.doctors.find("specialization", specialization)  # Return list of matching doctors
 
     def display_doctor_schedule(self, doctor_id):
         # Method to display the schedule of a specific doctor
         doctor = self.search_doctor(doctor_id)  # Find doctor by ID
         if doctor:
-            print(f"\nDoctor {doctor.name} Schedule:")
-            for date, times in doctor.schedule.items():  # Iterate through doctor's schedule
-                print(f"Date: {date}, Available Times:")  # Print date and available times
-                for idx, time in enumerate(times, 1):  # Enumerate available times
-                    print(f"{idx}. {time}")  # Print available times with indices
-        else:
-            print("Doctor not found.")  # Print error message if doctor not found
+            return self._emit(Result(True, "doctor_schedule", doctor))
+        return self._emit(Result(False, "doctor_schedule", message="Doctor not found."))
 
     def display_doctor_info(self, doctor_id):
         # Method to display information of a specific doctor
         doctor = self.search_doctor(doctor_id)  # Find doctor by ID
         if doctor:
-            print("\nDoctor Information:")
-            # Print various details of the doctor
-            print(f"ID: {doctor.id}")
-            print(f"Name: {doctor.name}")
-            print(f"Specialization: {doctor.specialization}")
-            print(f"Address: {doctor.address}")
-            print(f"Phone Number: {doctor.phone_number}")
-            print(f"Email: {doctor.email}")
-            print("Schedule:")
-            for date, times in doctor.schedule.items():  # Iterate through doctor's schedule
-                print(f"Date: {date}, Available Times:")  # Print date and available times
-                for time in times:  # Iterate through available times
-                    print(time)  # Print each available time
-        else:
-            print("Doctor not found.")  # Print error message if doctor not found
+            return self._emit(Result(True, "doctor", doctor))
+        return self._emit(Result(False, "doctor", message="Doctor not found."))
 
     def display_arrival_queue(self):
         # Method to display the arrival queue (patients waiting for arrival)
-        print("\nArrival Queue:")
-        for patient in self.arrival_queue:
-            print(
-                f"Patient ID: {patient.id}, Name: {patient.name}, Risk Level: {patient.risk_level}, Arrival Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return self._emit(Result(True, "arrival_queue", self.queue_entries(self.arrival_queue)))
+
+    def queue_entries(self, patients):
+        # Method to pair each queued patient with their arrival time
+        return [(patient, self.queue_stats.arrival_time(patient.id)) for patient in patients]
+
+    def queue_statistics(self):
+        # Method to get live consultation queue metrics: depth per risk level, rolling mean and p95 wait (seconds)
+        # and calls per hour; cheap enough to poll from a dashboard
+        return self.queue_stats.stats(self.consultation_queue.depth, now=self.clock())
+
+    def _emit(self, result):
+        # Helper method to hand a result to the presentation layer and return it to the caller
+        self.presenter.show(result)
+        return result
+
+    def _ask(self, prompt):
+        # Helper method to prompt the user once all pending output and writes have been flushed, so nothing that was
+        # reported as done waits in a batch while the user is typing
+        self.presenter.flush()
+        self.storage.flush()
+        return input(prompt)
 
     def menu(self):
         # Method to display the menu for hospital management system
         while True:  # Loop until user exits
-            print("\nHospital Management System")  # Print system title
-            print("1. Display Doctor's Schedule")  # Menu option 1
-            print("2. Schedule Appointment")  # Menu option 2
-            print("3. Remove Patient from Queue")  # Menu option 3
-            print("4. Update Patient Information")  # Menu option 4
-            print("5. Purchase Prescription")  # Menu option 5
-            print("6. Display Calling Queue")  # Menu option 6
-            print("7. Add New Patient")  # Menu option 7
-            print("8. Display Patient Information")  # Menu option 8
-            print("9. Display Doctor Information")  # Menu option 9
-            print("10. Display Arrival Queue")  # Menu option 10
-            print("11. Exit")  # Menu option 11
-            choice = input("Enter your choice: ")  # Prompt user for choice
+            self.presenter.say("\nHospital Management System")  # Print system title
+            self.presenter.say("1. Display Doctor's Schedule")  # Menu option 1
+            self.presenter.say("2. Schedule Appointment")  # Menu option 2
+            self.presenter.say("3. Remove Patient from Queue")  # Menu option 3
+            self.presenter.say("4. Update Patient Information")  # Menu option 4
+            self.presenter.say("5. Purchase Prescription")  # Menu option 5
+            self.presenter.say("6. Display Calling Queue")  # Menu option 6
+            self.presenter.say("7. Add New Patient")  # Menu option 7
+            self.presenter.say("8. Display Patient Information")  # Menu option 8
+            self.presenter.say("9. Display Doctor Information")  # Menu option 9
+            self.presenter.say("10. Display Arrival Queue")  # Menu option 10
+            self.presenter.say("11. Search Patients")  # Menu option 11
+            self.presenter.say("12. Census Report")  # Menu option 12
+            self.presenter.say("13. Exit")  # Menu option 13
+            choice = self._ask("Enter your choice: ")  # Prompt user for choice
             if choice == '1':  # Option 1: Display Doctor's Schedule
-                doctor_id = input("Enter doctor ID to view schedule: ")  # Prompt user for doctor ID
+                doctor_id = self._ask("Enter doctor ID to view schedule: ")  # Prompt user for doctor ID
                 self.display_doctor_schedule(doctor_id)  # Call method to display doctor's schedule
             elif choice == '2':  # Option 2: Schedule Appointment
-                print("Doctor's Schedule:")
-                for doctor in self.doctors:  # Iterate through list of doctors
-                    print(f"Doctor ID: {doctor.id}, Name: {doctor.name}")  # Print doctor IDs and names
-                    for date, times in doctor.schedule.items():  # Iterate through doctor's schedule
-                        print(f"Date: {date}, Available Times:")  # Print date and available times
-                        for idx, time in enumerate(times, 1):  # Enumerate available times
-                            print(f"{idx}. {time}")  # Print available times with indices
-                for patient in self.patients:  # Iterate through list of patients
-                    print(f"patient ID: {patient.id}, Name: {patient.name}")  # Print patient IDs and names
-                patient_id = input("Enter patient ID: ")  # Prompt user for patient ID
-                doctor_id = input("Enter doctor ID: ")  # Prompt user for doctor ID
-                date = input("Enter appointment date (YYYY-MM-DD): ")  # Prompt user for appointment date
-                time_idx = int(input(
-                    "Enter the number corresponding to the preferred appointment time: "))  # Prompt user for appointment time index
-                self.schedule_appointment(patient_id, doctor_id, date, time_idx)  # Call method to schedule appointment
+                patient_id = self._ask("Enter patient ID: ")  # Prompt user for patient ID
+                specialization = self._ask("Enter required specialization: ")  # Prompt user for specialization
+                after = self._ask("Enter earliest appointment date (YYYY-MM-DD, blank for any): ")  # Prompt user for date
+                slots = self.find_earliest_slot(specialization, after=parse_date(after) if after else None)
+                if slots:
+                    for idx, (when, doctor) in enumerate(slots, 1):  # Print the soonest available appointments
+                        self.presenter.say(f"{idx}. {when.strftime('%Y-%m-%d %I:%M %p')} with {doctor.name} (Doctor ID: {doctor.id})")
+                    slot_idx = int(self._ask(
+                        "Enter the number corresponding to the preferred appointment: "))  # Prompt user for appointment
+                    if 1 <= slot_idx <= len(slots):
+                        when, doctor = slots[slot_idx - 1]
+                        self.book_appointment(patient_id, doctor.id, when.strftime("%Y-%m-%d"),
+                                              when.strftime("%I:%M %p"))  # Call method to book the appointment
+                    else:
+                        self.presenter.say("Invalid time selection.")
+                else:
+                    self.presenter.say("No available appointments for that specialization.")
             elif choice == '3':  # Option 3: Remove Patient from Queue
-                password = input("Enter password: ")  # Prompt user for password
+                password = self._ask("Enter password: ")  # Prompt user for password
                 if password == "besthospital":  # Check if password is correct
-                    patient_id = input("Enter patient ID to remove from the queue: ")  # Prompt user for patient ID
+                    patient_id = self._ask("Enter patient ID to remove from the queue: ")  # Prompt user for patient ID
                     self.remove_patient_from_queue(patient_id)  # Call method to remove patient from queue
                 else:
-                    print("Incorrect password.")  # Print error message for incorrect password
+                    self.presenter.say("Incorrect password.")  # Print error message for incorrect password
             elif choice == '4':  # Option 4: Update Patient Information
-                password = input("Enter password: ")  # Prompt user for password
+                password = self._ask("Enter password: ")  # Prompt user for password
                 if password == "besthospital":  # Check if password is correct
-                    patient_id = input("Enter patient ID to update information: ")  # Prompt user for patient ID
-                    print("patient information before updating: ")
+                    patient_id = self._ask("Enter patient ID to update information: ")  # Prompt user for patient ID
+                    self.presenter.say("patient information before updating: ")
                     self.display_patient_info(patient_id)
-                    vital_signs_input = input(
+                    vital_signs_input = self._ask(
                         "Enter vital signs (key-value pairs, e.g., 'Blood Pressure:120/80 mmHg'): ")  # Prompt user for vital signs
                     vital_signs = dict(item.split(":") for item in
                                        vital_signs_input.split(","))  # Split input and create dictionary of vital signs
-                    weight = input("Enter patient weight: ")  # Prompt user for patient weight
+                    weight = self._ask("Enter patient weight: ")  # Prompt user for patient weight
                     self.update_patient_info(patient_id, vital_signs,
                                              weight)  # Call method to update patient information
                 else:
-                    print("Incorrect password.")  # Print error message for incorrect password
+                    self.presenter.say("Incorrect password.")  # Print error message for incorrect password
             elif choice == '5':  # Option 5: Purchase Prescription
-                patient_id = input("Enter patient ID to purchase prescription: ")  # Prompt user for patient ID
-                self.purchase_prescription(patient_id)  # Call method to purchase prescription
+                patient_id = self._ask("Enter patient ID to purchase prescription: ")  # Prompt user for patient ID
+                choice = None
+                if self.search_patient(patient_id):
+                    self.presenter.say("Prescription Purchase:")
+                    for idx, medication in enumerate(self.pharmacy, 1):  # List the catalog
+                        self.presenter.say(f"{idx}. {medication.name}")
+                    choice = self._ask("Enter your choice: ")  # Prompt user to enter choice
+                self.purchase_prescription(patient_id, choice)  # Call method to purchase prescription
             elif choice == '6':  # Option 6: Display Calling Queue
                 self.display_calling_queue()  # Call method to display calling queue
             elif choice == '7':  # Option 7: Add New Patient
                 # Prompt user for patient details
-                id = input("Enter patient ID: ")
-                name = input("Enter patient name: ")
-                age = int(input("Enter patient age: "))
-                gender = input("Enter patient gender: ")
-                address = input("Enter patient address: ")
-                phone_number = input("Enter patient phone number: ")
-                email = input("Enter patient email: ")
-                medical_condition = input("Enter patient's medical condition: ")
-                risk_level = int(input("Enter patient's risk level (1-5): "))
-                height = input("Enter patient height (optional): ")
-                weight = input("Enter patient weight (optional): ")
-                allergies = input("Enter patient allergies (comma-separated, optional): ").split(",")
-                previous_surgeries = input("Enter patient previous surgeries (comma-separated, optional): ").split(",")
-                vital_signs = input("Enter patient vital signs (key-value pairs, optional): ").split(",")
+                id = self._ask("Enter patient ID: ")
+                name = self._ask("Enter patient name: ")
+                age = int(self._ask("Enter patient age: "))
+                gender = self._ask("Enter patient gender: ")
+                address = self._ask("Enter patient address: ")
+                phone_number = self._ask("Enter patient phone number: ")
+                email = self._ask("Enter patient email: ")
+                medical_condition = self._ask("Enter patient's medical condition: ")
+                risk_level = int(self._ask("Enter patient's risk level (1-5): "))
+                height = self._ask("Enter patient height (optional): ")
+                weight = self._ask("Enter patient weight (optional): ")
+                allergies = self._ask("Enter patient allergies (comma-separated, optional): ").split(",")
+                previous_surgeries = self._ask("Enter patient previous surgeries (comma-separated, optional): ").split(",")
+                vital_signs = self._ask("Enter patient vital signs (key-value pairs, optional): ").split(",")
                 vital_signs = dict(item.split(":") for item in vital_signs)
                 # Call method to add new patient
                 self.add_patient(id, name, age, gender, address, phone_number, email, medical_condition, risk_level,
                                  height, weight, allergies, previous_surgeries, vital_signs)
             elif choice == '8':  # Option 8: Display Patient Information
-                password = input("Enter password: ")
+                password = self._ask("Enter password: ")
                 if password == "besthospital":
-                    patient_id = input("Enter patient ID to display information: ")  # Prompt user for patient ID
+                    patient_id = self._ask("Enter patient ID to display information: ")  # Prompt user for patient ID
                     self.display_patient_info(patient_id)  # Call method to display patient information
                 else:
-                    print("Incorrect password.")
+                    self.presenter.say("Incorrect password.")
             elif choice == '9':  # Option 9: Display Doctor Information
-                password = input("Enter password: ")
+                password = self._ask("Enter password: ")
                 if password == "besthospital":
-                    doctor_id = input("Enter doctor ID to display information: ")  # Prompt user for doctor ID
+                    doctor_id = self._ask("Enter doctor ID to display information: ")  # Prompt user for doctor ID
                     self.display_doctor_info(doctor_id)  # Call method to display doctor information
                 else:
-                    print("Incorrect password.")
+                    self.presenter.say("Incorrect password.")
             elif choice == '10':  # Option 10: Display Arrival Queue
                 self.display_arrival_queue()  # Call method to display arrival queue
-            elif choice == '11':  # Option 11: Exit
-                print("Exiting...")  # Print exit message
+            elif choice == '11':  # Option 11: Search Patients
+                query = self._ask("Enter name, phone number or email to search: ")  # Prompt user for search text
+                self.search_patients(query)  # Call method to list the best matches
+            elif choice == '12':  # Option 12: Census Report
+                self.census_report()  # Call method to display the census report
+            elif choice == '13':  # Option 13: Exit
+                self.presenter.say("Exiting...")  # Print exit message
+                self.close()  # Save pending changes before exiting
                 break  # Exit the loop
             else:  # Invalid choice
-                print("Invalid choice. Please enter a number from 1 to 11.")  # Print error message for invalid choic
+                self.presenter.say("Invalid choice. Please enter a number from 1 to 13.")  # Print error message for invalid choic
+
+
+class HospitalService:  # Defining a class that serves HospitalSystem operations to many clients over asyncio
+    # Protocol: each request is one JSON object per line, e.g. {"op": "search_patient", "patient_id": "P001"};
+    # each response is one JSON line {"ok": true/false, "result": ..., "error": ...} echoing the request's "id"
+    def __init__(self, system):
+        # Initializing the HospitalService around an existing HospitalSystem
+        self.system = system
+        self.locks = {}  # Entity key such as "doctor:D001" -> asyncio.Lock
+        self.flusher = None  # Task that flushes batched writes while the service runs
+        self.handlers = {
+            "search_patient": self.search_patient,
+            "search_patients": self.search_patients,
+            "queue_stats": self.queue_stats,
+            "census": self.census,
+            "add_patient": self.add_patient,
+            "update_patient": self.update_patient,
+            "record_vital_sign": self.record_vital_sign,
+            "find_earliest_slot": self.find_earliest_slot,
+            "book_appointment": self.book_appointment,
+            "calling_queue": self.calling_queue,
+            "add_to_queue": self.add_to_queue,
+            "remove_from_queue": self.remove_from_queue,
+            "call_next_patient": self.call_next_patient,
+            "purchase_prescription": self.purchase_prescription,
+            "dispense_prescriptions": self.dispense_prescriptions,
+            "metrics": self.metrics,
+            "profile": self.profile,
+        }
+
+    def lock_keys(self, request):
+        # Method to list the entities a request changes, so requests on different entities do not wait on each other
+        keys = []
+        if "doctor_id" in request:
+            keys.append(f"doctor:{request['doctor_id']}")
+        if "patient_id" in request:
+            keys.append(f"patient:{request['patient_id']}")
+        if request["op"] in ("add_to_queue", "remove_from_queue", "call_next_patient", "book_appointment",
+                             "purchase_prescription", "dispense_prescriptions"):
+            keys.append("queue")  # Changes to the shared calling queue are serialized
+        return sorted(keys)  # Always lock in the same order to avoid deadlocks
+
+    async def handle(self, request):
+        # Method to run one request under the locks of the entities it touches
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Request must be a JSON object"}
+        handler = self.handlers.get(request.get("op"))
+        if handler is None:
+            return {"ok": False, "error": f"Unknown operation: {request.get('op')}"}
+        locks = [self.locks.setdefault(key, asyncio.Lock()) for key in self.lock_keys(request)]
+        for lock in locks:
+            await lock.acquire()
+        try:
+            # A check-then-book sequence runs while holding the doctor's lock, so a slot cannot be booked twice
+            return handler(request)
+        except KeyError as error:
+            return {"ok": False, "error": f"Missing field: {error.args[0]}"}
+        except Exception as error:  # A field of the wrong type fails the request, not the client's connection
+            return {"ok": False, "error": str(error) or type(error).__name__}
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    async def serve_client(self, reader, writer):
+        # Method to answer requests from one connection until it closes
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await self.handle(request)
+                    if isinstance(request, dict) and "id" in request:
+                        response["id"] = request["id"]
+                except ValueError:
+                    response = {"ok": False, "error": "Invalid JSON request"}
+                writer.write((json.dumps(response, default=str) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass  # The client went away
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765):
+        # Method to start listening; returns the asyncio server
+        self.flusher = asyncio.get_running_loop().create_task(self.flush_periodically())
+        return await asyncio.start_server(self.serve_client, host, port)
+
+    async def flush_periodically(self):
+        # Method to commit batched writes at least every flush interval, even when no further requests arrive
+        storage = self.system.storage
+        while True:
+            await asyncio.sleep(getattr(storage, "flush_interval", 1.0))
+            storage.flush()
+
+    def reply(self, result, data=None):
+        # Method to convert an operation Result into a response
+        if not result.ok:
+            return {"ok": False, "error": result.message}
+        return {"ok": True, "result": data}
+
+    def search_patient(self, request):
+        patient = self.system.search_patient(request["patient_id"])
+        if patient is None:
+            return {"ok": False, "error": "Patient not found."}
+        return {"ok": True, "result": patient_to_dict(patient)}
+
+    def search_patients(self, request):
+        result = self.system.search_patients(request["query"], request.get("limit", 10))
+        return {"ok": True, "result": [{"id": patient.id, "name": patient.name, "score": round(score, 3)}
+                                       for score, patient in result.data]}
+
+    def add_patient(self, request):
+        result = self.system.add_patient(**request["patient"])
+        return self.reply(result, result.data and result.data.id)
+
+    def update_patient(self, request):
+        patient = self.system.search_patient(request["patient_id"])
+        weight = request["weight"] if "weight" in request else patient and patient.weight  # Unchanged if absent
+        return self.reply(self.system.update_patient_info(request["patient_id"], request.get("vital_signs", {}),
+                                                          weight))
+
+    def record_vital_sign(self, request):
+        result = self.system.record_vital_sign(request["patient_id"], request["key"], request["value"])
+        return self.reply(result, result.data)
+
+    def find_earliest_slot(self, request):
+        after = request.get("after")
+        slots = self.system.find_earliest_slot(request["specialization"],
+                                               after=datetime.fromisoformat(after) if after else None,
+                                               limit=request.get("limit", 5))
+        return {"ok": True, "result": [{"doctor_id": doctor.id, "date": when.strftime("%Y-%m-%d"),
+                                        "time": when.strftime("%I:%M %p")} for when, doctor in slots]}
+
+    def book_appointment(self, request):
+        result = self.system.book_appointment(request["patient_id"], request["doctor_id"], request["date"],
+                                              request["time"])
+        return self.reply(result, result.data)
+
+    def calling_queue(self, request):
+        patients = self.system.consultation_queue.peek(request.get("limit", 10))
+        return {"ok": True, "result": [{"id": patient.id, "name": patient.name, "risk_level": patient.risk_level,
+                                        "arrived": self.system.queue_stats.arrivals.get(patient.id)}
+                                       for patient in patients]}
+
+    def queue_stats(self, request):
+        return {"ok": True, "result": self.system.queue_statistics()}
+
+    def census(self, request):
+        return {"ok": True, "result": self.system.census_report(request.get("days", 7)).data}
+
+    def add_to_queue(self, request):
+        return self.reply(self.system.add_to_queue(request["patient_id"]))
+
+    def remove_from_queue(self, request):
+        return self.reply(self.system.remove_patient_from_queue(request["patient_id"]))
+
+    def call_next_patient(self, request):
+        result = self.system.call_next_patient()
+        return self.reply(result, result.data and result.data.id)
+
+    def purchase_prescription(self, request):
+        result = self.system.purchase_prescription(request["patient_id"],
+                                                   str(request.get("medication") or request["choice"]),
+                                                   request.get("quantity", 1))
+        return self.reply(result, result.data and prescription_to_dict(result.data))
+
+    def dispense_prescriptions(self, request):
+        result = self.system.dispense_prescriptions(request["orders"])
+        return self.reply(result, result.data)
+
+    def metrics(self, request):
+        if self.system.instrumentation is None:
+            return {"ok": False, "error": "Instrumentation is not enabled."}
+        return {"ok": True, "result": self.system.instrumentation.prometheus()}
+
+    def profile(self, request):
+        # Request {"op": "profile", "action": "start" (with optional "calls" and "every"), "stop" or "report"}
+        instrumentation = self.system.instrumentation
+        if instrumentation is None:
+            return {"ok": False, "error": "Instrumentation is not enabled."}
+        action = request.get("action", "report")
+        if action == "start":
+            instrumentation.start_profile(request.get("calls", 1000), request.get("every", 10))
+        elif action == "stop":
+            instrumentation.stop_profile()
+        elif action != "report":
+            return {"ok": False, "error": f"Unknown profile action: {action}"}
+        return {"ok": True, "result": instrumentation.profile_report(limit=request.get("limit", 25))}
+
+
+async def serve(system, host="127.0.0.1", port=8765):
+    # Function to run the hospital service until it is cancelled
+    server = await HospitalService(system).start(host, port)
+    print(f"Hospital service listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
 
 
 # Main function
 if __name__ == "__main__":
-    hospital_system = HospitalSystem()  # Create an instance of HospitalSystem
-    hospital_system.menu()
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":  # Serve many clients instead of the interactive menu
+        hospital_system = HospitalSystem(SQLiteStorage("hospital.db"), presenter=quiet_presenter())
+        if "--metrics" in sys.argv:  # Also time operations and serve them at http://127.0.0.1:<port>/metrics
+            metrics_port = int(sys.argv.pop(sys.argv.index("--metrics") + 1))
+            sys.argv.remove("--metrics")
+            hospital_system.instrument().serve(port=metrics_port)
+        try:
+            asyncio.run(serve(hospital_system, port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            hospital_system.close()
+    else:
+        hospital_system = HospitalSystem(SQLiteStorage("hospital.db"))  # Create an instance of HospitalSystem
+        try:
+            hospital_system.menu()
+        finally:
+            hospital_system.close()  # Save pending changes even on Ctrl-C or an error
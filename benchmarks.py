@@ -0,0 +1,551 @@
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+# Loading the hospital system module from its script file (the file name contains spaces)
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Hospital  system.py")
+_spec = importlib.util.spec_from_file_location("hospital_system", _path)
+hospital = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = hospital  # Registered so worker processes can pickle its functions and classes
+_spec.loader.exec_module(hospital)
+
+
+def make_patient(i, rng):
+    # Helper function to build a synthetic patient record
+    return hospital.Patient(f"P{i:07d}", f"Patient {i}", rng.randint(1, 95), rng.choice(("Male", "Female")),
+                            f"{i} Main St", f"555-{i:07d}", f"patient{i}@example.com",
+                            rng.choice(("Fever", "Diabetes", "Broken Arm", "Asthma", "Flu")), rng.randint(1, 5))
+
+
+def bench_registry(sizes=(10_000, 100_000, 1_000_000)):
+    # Benchmark comparing ID lookup latency of a linear list scan against the hash-indexed registry
+    rng = random.Random(42)
+    print(f"{'records':>10} {'list scan (us)':>16} {'registry (us)':>15} {'speedup':>10}")
+    for size in sizes:
+        patients = [make_patient(i, rng) for i in range(size)]
+        registry = hospital.Registry(("phone_number", "email", "medical_condition"))
+        for patient in patients:
+            registry.add(patient)
+        scan_ids = [patients[rng.randrange(size)].id for _ in range(50)]  # A full scan is slow, so sample fewer IDs
+        lookup_ids = [patients[rng.randrange(size)].id for _ in range(100_000)]
+
+        start = time.perf_counter()
+        for patient_id in scan_ids:  # Same loop the old search_patient used
+            for patient in patients:
+                if patient.id == patient_id:
+                    break
+        scan = (time.perf_counter() - start) / len(scan_ids)
+
+        start = time.perf_counter()
+        for patient_id in lookup_ids:
+            registry.get(patient_id)
+        indexed = (time.perf_counter() - start) / len(lookup_ids)
+        print(f"{size:>10} {scan * 1e6:>16.2f} {indexed * 1e6:>15.3f} {scan / indexed:>9.0f}x")
+        del patients, registry
+
+
+def bench_triage(sizes=(1_000, 10_000, 100_000)):
+    # Benchmark comparing the old sort-on-display calling queue against the heap-based TriageQueue
+    rng = random.Random(42)
+    print(f"{'queued':>10} {'op':>18} {'list+sort (us)':>15} {'heap (us)':>10}")
+    for size in sizes:
+        patients = [make_patient(i, rng) for i in range(size)]
+        queue = hospital.TriageQueue()
+        for patient in patients:
+            queue.push(patient)
+        legacy = list(patients)
+        victims = rng.sample(patients, 20)
+
+        start = time.perf_counter()
+        for _ in range(20):  # Option 6: the old display sorted the whole queue to show it
+            sorted(legacy, key=lambda x: x.risk_level, reverse=True)[:10]
+        legacy_view = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        for _ in range(20):
+            list(queue.peek(10))
+        heap_view = (time.perf_counter() - start) / 20
+        print(f"{size:>10} {'next 10 view':>18} {legacy_view * 1e6:>15.1f} {heap_view * 1e6:>10.1f}")
+
+        system = hospital.HospitalSystem(presenter=hospital.quiet_presenter(), sample_data=False)
+        system.consultation_queue = queue
+        start = time.perf_counter()
+        for _ in range(5):  # Option 6 lists the whole queue with arrival times
+            system.queue_entries(sorted(legacy, key=lambda x: x.risk_level, reverse=True))
+        legacy_list = (time.perf_counter() - start) / 5
+        start = time.perf_counter()
+        for _ in range(5):
+            system.display_calling_queue()
+        heap_list = (time.perf_counter() - start) / 5
+        print(f"{size:>10} {'full queue view':>18} {legacy_list * 1e6:>15.1f} {heap_list * 1e6:>10.1f}")
+
+        start = time.perf_counter()
+        for patient in victims:  # The old removal was list.remove followed by a full re-sort
+            legacy.remove(patient)
+            sorted(legacy, key=lambda x: x.risk_level, reverse=True)
+        legacy_remove = (time.perf_counter() - start) / len(victims)
+        start = time.perf_counter()
+        for patient in victims:
+            queue.remove(patient)
+        heap_remove = (time.perf_counter() - start) / len(victims)
+        print(f"{size:>10} {'remove by patient':>18} {legacy_remove * 1e6:>15.1f} {heap_remove * 1e6:>10.1f}")
+
+
+def bench_earliest_slot(sizes=(5_000,), days=90):
+    # Benchmark of find_earliest_slot against a full calendar scan, with 15-minute slots over an 8-hour day
+    rng = random.Random(42)
+    specializations = ("Cardiologist", "Neurologist", "Pediatrician", "Dermatologist", "Oncologist",
+                       "Orthopedist", "Psychiatrist", "Radiologist", "Surgeon", "Urologist")
+    start_date = datetime(2024, 4, 1)
+    dates = [(start_date + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(days)]
+    for size in sizes:
+        system = hospital.HospitalSystem.__new__(hospital.HospitalSystem)  # Skip the sample data
+        system.doctors = hospital.Registry(("specialization",))
+        for i in range(size):
+            doctor = hospital.Doctor(f"D{i:05d}", f"Dr. {i}", rng.choice(specializations), "Hospital Rd", "555", "d@x")
+            for date in dates:
+                doctor.add_schedule_range(date, "09:00 AM", 32)
+                doctor.schedule[date].booked_mask = (rng.getrandbits(32) | rng.getrandbits(32)) << 36  # ~75% booked
+            system.doctors.add(doctor)
+        after = start_date + timedelta(days=days // 2, hours=13)
+        print(f"{size} doctors x {days} days, {sum(len(d.dates) for d in system.doctors)} doctor-days")
+
+        start = time.perf_counter()
+        for specialization in specializations:  # Old approach: walk every doctor's whole calendar, then sort
+            found = []
+            for doctor in system.doctors:
+                if doctor.specialization == specialization:
+                    for date in doctor.dates:
+                        for slot in doctor.schedule[date].free_slots():
+                            when = hospital.parse_date(date) + timedelta(minutes=slot * hospital.SLOT_MINUTES)
+                            if when >= after:
+                                found.append((when, doctor.id))
+            sorted(found)[:10]
+        scan = (time.perf_counter() - start) / len(specializations)
+
+        start = time.perf_counter()
+        for specialization in specializations:
+            system.find_earliest_slot(specialization, after=after, limit=10)
+        indexed = (time.perf_counter() - start) / len(specializations)
+        print(f"full scan: {scan * 1e3:.1f} ms/query, find_earliest_slot: {indexed * 1e3:.2f} ms/query")
+
+
+def bench_bulk_import(sizes=(200_000,)):
+    # Benchmark of streaming bulk import/export throughput in records per second
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for format in ("csv", "jsonl"):
+                path = os.path.join(directory, f"patients.{format}")
+                records = ({"id": f"P{i:08d}", "name": f"Patient {i}", "age": rng.randint(1, 95), "gender": "Female",
+                            "address": f"{i} Main St", "phone_number": f"555-{i:07d}",
+                            "email": f"patient{i}@example.com", "medical_condition": "Flu",
+                            "risk_level": rng.randint(1, 5), "height": "170 cm", "weight": "70 kg",
+                            "allergies": [], "previous_surgeries": [], "vital_signs": {}} for i in range(size))
+                hospital.write_patient_records(path, records)
+                for enqueue in (False, True):
+                    system = hospital.HospitalSystem(presenter=hospital.quiet_presenter())
+                    start = time.perf_counter()
+                    system.import_patients(path, enqueue=enqueue)
+                    elapsed = time.perf_counter() - start
+                    print(f"import {format:>5} {size:>9} records, enqueue={enqueue!s:>5}: {size / elapsed:>10,.0f} records/s")
+                start = time.perf_counter()
+                system.export_patients(path)
+                elapsed = time.perf_counter() - start
+                print(f"export {format:>5} {size:>9} records: {size / elapsed:>27,.0f} records/s")
+                del system
+
+
+class LegacyPatient:  # The original dict-based Patient layout, kept for memory comparison
+    def __init__(self, id, name, age, gender, address, phone_number, email, medical_condition, risk_level, height=None,
+                 weight=None, allergies=None, previous_surgeries=None, vital_signs=None):
+        self.id = id
+        self.name = name
+        self.age = age
+        self.gender = gender
+        self.address = address
+        self.phone_number = phone_number
+        self.email = email
+        self.medical_condition = medical_condition
+        self.risk_level = risk_level
+        self.height = height
+        self.weight = weight
+        self.allergies = allergies if allergies else []
+        self.previous_surgeries = previous_surgeries if previous_surgeries else []
+        self.vital_signs = vital_signs if vital_signs else {}
+        self.prescriptions = []
+
+
+def bench_patient_memory(sizes=(1_000_000,)):
+    # Benchmark reporting bytes per patient for the dict-based, __slots__ and columnar layouts
+    conditions = ("Fever", "Diabetes", "Broken Arm", "Asthma", "Flu")
+    layouts = (("dict (old)", LegacyPatient), ("__slots__", hospital.Patient),
+               ("columnar", lambda *args, **kwargs: table.append(*args, **kwargs)))
+    for size in sizes:
+        for label, factory in layouts:
+            table = hospital.PatientTable()
+            tracemalloc.start()
+            patients = [factory(f"P{i:07d}", f"Patient {i}", 20 + i % 70, ("Male", "Female")[i % 2], f"{i} Main St",
+                                f"555-{i:07d}", f"patient{i}@example.com", conditions[i % 5], 1 + i % 5,
+                                height=f"{150 + i % 40} cm", weight=f"{50 + i % 50} kg") for i in range(size)]
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"{label:>12}: {current / size:>7.0f} bytes/patient ({size} patients)")
+            del patients, table
+
+
+def bench_vitals(sizes=(5_000,), readings=200_000):
+    # Benchmark of vital sign ingestion rate and windowed aggregate latency across monitored beds
+    rng = random.Random(42)
+    for beds in sizes:
+        store = hospital.VitalSignsStore()
+        now = time.time()
+        feed = [(f"P{rng.randrange(beds):07d}", rng.choice(("Pulse Rate", "Body Temperature", "Blood Pressure")),
+                 now + i / 10_000) for i in range(readings)]  # 10k readings/sec of simulated time
+        values = {"Pulse Rate": "{} bpm", "Body Temperature": "{}°F", "Blood Pressure": "{}/80 mmHg"}
+        feed = [(patient_id, key, values[key].format(rng.randint(60, 140)), timestamp)
+                for patient_id, key, timestamp in feed]
+        start = time.perf_counter()
+        for patient_id, key, value, timestamp in feed:
+            store.record(patient_id, key, value, timestamp)
+        elapsed = time.perf_counter() - start
+        print(f"{beds} beds: {readings / elapsed:,.0f} readings/s ingested, {len(store.alerts)} alerts")
+        end = now + readings / 10_000
+        start = time.perf_counter()
+        for i in range(10_000):
+            store.aggregate(f"P{i % beds:07d}", "Pulse Rate", 5, now=end)
+        print(f"{beds} beds: {(time.perf_counter() - start) / 10_000 * 1e6:.1f} us per 5-minute aggregate")
+        # The same readings through HospitalSystem.record_vital_sign: validation, the operation log and snapshots
+        for label in ("memory only", "SQLite log"):
+            with tempfile.TemporaryDirectory() as directory:
+                storage = hospital.SQLiteStorage(os.path.join(directory, "vitals.db")) if label == "SQLite log" else None
+                system = hospital.HospitalSystem(storage, presenter=hospital.quiet_presenter(), sample_data=False)
+                system.import_patients(_write_beds(directory, beds), enqueue=False)
+                start = time.perf_counter()
+                for i in range(readings):
+                    system.record_vital_sign(f"B{i % beds:07d}", "Pulse Rate", f"{rng.randint(40, 140)} bpm",
+                                             end + i / 10_000)
+                system.close()
+                elapsed = time.perf_counter() - start
+                print(f"{beds} beds, {label}: {readings / elapsed:,.0f} readings/s through record_vital_sign")
+
+
+def _write_beds(directory, beds):
+    # Helper function to write a JSONL file of monitored patients; returns its path
+    path = os.path.join(directory, "beds.jsonl")
+    hospital.write_patient_records(path, ({"id": f"B{i:07d}", "name": f"Bed {i}", "age": 50, "gender": "Female",
+                                           "address": "Ward", "phone_number": "555", "email": "b@x",
+                                           "medical_condition": "Flu", "risk_level": 2} for i in range(beds)))
+    return path
+
+
+def _run_service(port_queue, patients, doctors):
+    # Helper function run in a child process: serve a synthetic hospital on a free port
+    rng = random.Random(7)
+    system = hospital.HospitalSystem(presenter=hospital.quiet_presenter())
+    for i in range(patients):
+        system.add_patient(f"S{i:06d}", f"Patient {i}", 40, "Female", "Main St", "555", "p@x", "Flu",
+                           rng.randint(1, 5))
+    for i in range(doctors):
+        system.add_doctor(f"SD{i:04d}", f"Dr. {i}", "Cardiologist", "Hospital Rd", "555", "d@x")
+        for day in range(1, 29):
+            system.add_schedule(f"SD{i:04d}", f"2024-05-{day:02d}", "09:00 AM", 32)
+
+    async def main():
+        service = hospital.HospitalService(system)
+        server = await service.start(port=0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+    asyncio.run(main())
+
+
+def bench_service(sizes=(1, 16, 256), requests=4_000, patients=10_000, doctors=50):
+    # Load generator reporting latency percentiles and throughput of the asyncio service per concurrency level
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_service, args=(port_queue, patients, doctors), daemon=True)
+    process.start()
+    port = port_queue.get()
+
+    async def client(requests_per_client, latencies, booked, rng):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(requests_per_client):
+            roll = rng.random()
+            if roll < 0.6:
+                request = {"op": "search_patient", "patient_id": f"S{rng.randrange(patients):06d}"}
+            elif roll < 0.8:
+                request = {"op": "find_earliest_slot", "specialization": "Cardiologist", "limit": 5}
+            else:  # Every client competes for the same small set of slots, to check nothing is double-booked
+                request = {"op": "book_appointment", "patient_id": f"S{rng.randrange(patients):06d}",
+                           "doctor_id": f"SD{rng.randrange(doctors):04d}", "date": f"2024-05-{rng.randint(1, 28):02d}",
+                           "time": hospital.format_time(36 + rng.randrange(32))}
+            start = time.perf_counter()
+            writer.write((json.dumps(request) + "\n").encode())
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if request["op"] == "book_appointment" and response["ok"]:
+                slot = (request["doctor_id"], request["date"], request["time"])
+                booked[slot] = booked.get(slot, 0) + 1
+        writer.close()
+        await writer.wait_closed()
+
+    async def run(concurrency, rng, booked):
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(client(requests // concurrency, latencies, booked, rng) for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+    rng = random.Random(42)
+    booked = {}
+    print(f"{'clients':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'requests/s':>11}")
+    for concurrency in sizes:
+        latencies, elapsed = asyncio.run(run(concurrency, rng, booked))
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{concurrency:>8} {p50 * 1e3:>9.2f} {p99 * 1e3:>9.2f} {len(latencies) / elapsed:>11,.0f}")
+    print(f"successful bookings: {sum(booked.values())}, double-booked slots: "
+          f"{sum(1 for count in booked.values() if count > 1)}")
+    process.terminate()
+
+
+def bench_output(sizes=(100_000,)):
+    # Benchmark of mixed operations with console text output (written to the null device) versus quiet mode
+    modes = (("console, unbuffered", lambda stream: hospital.Presenter(writer=hospital.BufferedWriter(stream))),
+             ("console, buffered", lambda stream: hospital.Presenter(
+                 writer=hospital.BufferedWriter(stream, buffer_size=1 << 16))),
+             ("json, buffered", lambda stream: hospital.Presenter(
+                 hospital.JSONFormatter(), hospital.BufferedWriter(stream, buffer_size=1 << 16), redisplay=False)),
+             ("quiet", lambda stream: hospital.quiet_presenter()))
+    for size in sizes:
+        for label, make_presenter in modes:
+            rng = random.Random(42)
+            with open(os.devnull, "w") as stream:
+                system = hospital.HospitalSystem(presenter=make_presenter(stream))
+                for i in range(100):
+                    system.add_patient(f"B{i:04d}", f"Patient {i}", 40, "Male", "Main St", "555", "p@x", "Flu",
+                                       rng.randint(1, 5))
+                start = time.perf_counter()
+                for i in range(size):
+                    roll = rng.random()
+                    patient_id = f"B{rng.randrange(100):04d}"
+                    if roll < 0.3:
+                        system.add_patient(f"N{i:07d}", f"Patient {i}", 40, "Male", "Main St", "555", "p@x", "Flu",
+                                           rng.randint(1, 5))
+                    elif roll < 0.6:
+                        system.display_patient_info(patient_id)
+                    elif roll < 0.8:
+                        system.update_patient_info(patient_id, {"Pulse Rate": "80 bpm"}, "70 kg")
+                    elif roll < 0.9:
+                        system.update_risk_level(patient_id, rng.randint(1, 5))
+                    else:
+                        system.display_doctor_schedule("D001")
+                system.close()
+                elapsed = time.perf_counter() - start
+            print(f"{label:>20}: {size / elapsed:>9,.0f} operations/s ({elapsed:.2f} s for {size} operations)")
+
+
+def bench_search(sizes=(1_000_000,), queries=200):
+    # Benchmark of fuzzy patient search latency and top-10 recall for misspelled names, prefixes and phone numbers
+    rng = random.Random(42)
+    syllables = ("ma", "ri", "an", "jo", "na", "el", "sa", "li", "ha", "mo", "ra", "ke", "to", "bi", "su", "de", "ya",
+                 "fa", "lu", "ne", "ar", "om", "is", "ul")
+
+    def word():
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+
+    first_names = [word() for _ in range(3_000)]
+    last_names = [word() for _ in range(8_000)]
+    for size in sizes:
+        index = hospital.PatientSearchIndex()
+        patients = []
+        start = time.perf_counter()
+        for i in range(size):
+            first, last = rng.choice(first_names), rng.choice(last_names)
+            patient = hospital.Patient(f"P{i:07d}", f"{first} {last}", 40, "Female", f"{i} Main St",
+                                       f"555-{rng.randrange(1000):03d}-{rng.randrange(10_000):04d}",
+                                       f"{first.lower()}.{last.lower()}{i % 100}@example.com", "Flu", 1)
+            index.add(patient)
+            patients.append(patient)
+        print(f"{size} patients: index built in {time.perf_counter() - start:.1f} s")
+        typos = []
+        for number, patient in enumerate(rng.sample(patients, queries)):
+            letters = list(patient.name.lower())
+            i = rng.randrange(1, len(letters) - 1)
+            if number % 2:
+                del letters[i]  # Drop a letter
+            else:
+                letters[i], letters[i + 1] = letters[i + 1], letters[i]  # Swap two adjacent letters
+            typos.append(("".join(letters), patient.id))
+        workloads = (("misspelled name", typos),
+                     ("name prefix", [(query[:4], None) for query, _ in typos]),
+                     ("phone number", [(patient.phone_number, patient.id) for patient in rng.sample(patients, queries)]))
+        for label, workload in workloads:
+            hits = 0
+            start = time.perf_counter()
+            for query, patient_id in workload:
+                hits += any(match == patient_id for _, match in index.search(query))
+            elapsed = (time.perf_counter() - start) / len(workload)
+            recall = f", recall@10 {hits / len(workload):.2f}" if workload[0][1] else ""
+            print(f"{label:>16}: {elapsed * 1e3:.2f} ms per query{recall}")
+
+
+def bench_queue_stats(sizes=(1_000_000,)):
+    # Benchmark of queue event throughput with live wait-time metrics, and the latency of reading the metrics
+    rng = random.Random(42)
+    for events in sizes:
+        system = hospital.HospitalSystem(presenter=hospital.quiet_presenter())
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(events):
+            if rng.random() < 0.5 or not system.consultation_queue:  # Arrivals and calls balance out
+                patient = make_patient(i, rng)
+                system.patients.add(patient)
+                system._enqueue(patient, now + i)
+            else:
+                system._dequeue(next(system.consultation_queue.peek(1)), now + i, called=True)
+        elapsed = time.perf_counter() - start
+        print(f"{events} queue events: {events / elapsed:,.0f} events/s with metrics")
+        start = time.perf_counter()
+        for _ in range(10_000):
+            stats = system.queue_stats.stats(system.consultation_queue.depth, now + events)
+        print(f"stats snapshot: {(time.perf_counter() - start) / 10_000 * 1e6:.1f} us, {stats}")
+
+
+def bench_pharmacy(sizes=(50_000,), patients=20_000):
+    # Benchmark of a ward round: dispensing many prescriptions one call at a time versus in one batch call
+    allergies = ((), (), (), ("Penicillin",), ("NSAIDs",))
+    for size in sizes:
+        for label in ("one by one", "batch"):
+            rng = random.Random(42)
+            with tempfile.TemporaryDirectory() as directory:
+                system = hospital.HospitalSystem(hospital.SQLiteStorage(os.path.join(directory, "hospital.db")),
+                                                 presenter=hospital.quiet_presenter())
+                for i in range(patients):
+                    patient = make_patient(i, rng)
+                    patient.allergies = list(rng.choice(allergies))
+                    system.patients.add(patient)
+                for medication in system.pharmacy:
+                    system.restock_medication(medication.code, size)
+                orders = [{"patient_id": f"P{rng.randrange(patients):07d}",
+                           "medication": rng.choice(("Aspirin", "Ibuprofen", "Paracetamol", "Antibiotics"))}
+                          for _ in range(size)]
+                start = time.perf_counter()
+                if label == "batch":
+                    dispensed = system.dispense_prescriptions(orders).data["dispensed"]
+                else:
+                    dispensed = sum(bool(system.purchase_prescription(order["patient_id"], order["medication"]))
+                                    for order in orders)
+                system.close()  # Include flushing the log
+                elapsed = time.perf_counter() - start
+            print(f"{label:>10}: {size / elapsed:>9,.0f} orders/s ({dispensed} dispensed, "
+                  f"{size - dispensed} rejected for allergies)")
+
+
+def bench_census(sizes=(5_000_000,), per_patient=5):
+    # Benchmark of census reports over many prescriptions: ad-hoc Python loops versus the columnar analytics
+    rng = random.Random(42)
+    medications = ("Aspirin", "Ibuprofen", "Paracetamol", "Antibiotics", "Antihistamines")
+    now = time.time()
+    for size in sizes:
+        system = hospital.HospitalSystem(presenter=hospital.quiet_presenter())
+        for i in range(size // per_patient):
+            system.patients.add(make_patient(i, rng), index=False)
+        for patient in system.patients:
+            patient.prescriptions = [hospital.Prescription(rng.choice(medications), "10 mg", "Once daily", "After meal",
+                                                           now - rng.randrange(90) * 86_400)
+                                     for _ in range(per_patient)]
+        week = range(datetime.now().toordinal() - 6, datetime.now().toordinal() + 1)
+        start = time.perf_counter()
+        high_risk = sum(1 for patient in system.patients
+                        if patient.risk_level >= 4 and patient.medical_condition == "Diabetes" and patient.age > 60)
+        top = Counter(prescription.medication for patient in system.patients for prescription in patient.prescriptions
+                      if datetime.fromtimestamp(prescription.issued).toordinal() in week).most_common(3)
+        print(f"{size} prescriptions, python loops: {time.perf_counter() - start:.2f} s ({high_risk} high-risk, {top})")
+        for processes in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            system.analytics = hospital.CensusAnalytics(system).build(processes=processes)
+            print(f"  snapshot build, {processes} process(es): {time.perf_counter() - start:.2f} s")
+        analytics = system.analytics
+        for label in ("cold", "cached"):
+            start = time.perf_counter()
+            high_risk = analytics.count("patients", {"risk_level": range(4, 6), "medical_condition": "Diabetes",
+                                                     "age": range(61, 200)})
+            top = analytics.group_by("prescriptions", "medication", {"day": week}).most_common(3)
+            bands = analytics.histogram("patients", "age", (0, 18, 40, 60, 80))
+            joined = analytics.group_by("prescriptions", "medication", patients={"risk_level": 5}).most_common(1)
+            print(f"  columnar, {label}: {time.perf_counter() - start:.3f} s ({high_risk} high-risk, {top}, {bands}, "
+                  f"risk-5 top {joined})")
+        system.update_risk_level("P0000001", 5)  # One write invalidates only the aggregates of one patient shard
+        start = time.perf_counter()
+        analytics.count("patients", {"risk_level": range(4, 6), "medical_condition": "Diabetes", "age": range(61, 200)})
+        analytics.group_by("prescriptions", "medication", {"day": week})
+        print(f"  columnar, after one write: {time.perf_counter() - start:.3f} s")
+
+
+def bench_instrumentation(sizes=(1_000_000,)):
+    # Microbenchmark of the per-call cost of instrumentation on the cheapest operation (an ID lookup), for a system
+    # never instrumented, one whose instrumentation was disabled again, one timing calls, and one also profiling
+    for calls in sizes:
+        system = hospital.HospitalSystem(presenter=hospital.quiet_presenter())
+
+        def per_call():
+            lookup = system.search_patient
+            best = float("inf")
+            for _ in range(5):  # Best of five runs, to keep scheduler noise out of the comparison
+                start = time.perf_counter()
+                for _ in range(calls):
+                    lookup("P002")
+                best = min(best, time.perf_counter() - start)
+            return best / calls * 1e9
+
+        baseline = per_call()
+        print(f"{calls} calls of search_patient (ns per call, best of 5):")
+        print(f"  never instrumented:     {baseline:8.1f}")
+        system.instrument()
+        system.uninstrument()
+        disabled = per_call()
+        print(f"  instrumentation off:    {disabled:8.1f} ({(disabled / baseline - 1) * 100:+.1f}%)")
+        instrumentation = system.instrument()
+        enabled = per_call()
+        print(f"  instrumentation on:     {enabled:8.1f} ({enabled - baseline:+.0f} ns)")
+        instrumentation.start_profile(calls=10 * calls, every=100)
+        profiled = per_call()
+        print(f"  profiling 1 in 100:     {profiled:8.1f} ({profiled - baseline:+.0f} ns)")
+        system.uninstrument()
+
+
+BENCHMARKS = {
+    "registry": bench_registry,
+    "triage": bench_triage,
+    "earliest_slot": bench_earliest_slot,
+    "bulk_import": bench_bulk_import,
+    "patient_memory": bench_patient_memory,
+    "vitals": bench_vitals,
+    "service": bench_service,
+    "output": bench_output,
+    "search": bench_search,
+    "queue_stats": bench_queue_stats,
+    "pharmacy": bench_pharmacy,
+    "census": bench_census,
+    "instrumentation": bench_instrumentation,
+}
+
+if __name__ == "__main__":
+    # Usage: python benchmarks.py <name> [size ...]
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmarks.py <{'|'.join(BENCHMARKS)}> [size ...]")
+        sys.exit(1)
+    args = [int(arg) for arg in sys.argv[2:]]
+    if args:
+        BENCHMARKS[sys.argv[1]](args)
+    else:
+        BENCHMARKS[sys.argv[1]]()
@@ -0,0 +1,312 @@
+import argparse
+import heapq
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Loading the hospital system module from its script file (the file name contains spaces)
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Hospital  system.py")
+_spec = importlib.util.spec_from_file_location("hospital_system", _path)
+hospital = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = hospital  # Registered so worker processes can pickle its functions and classes
+_spec.loader.exec_module(hospital)
+
+SYLLABLES = ("ma", "ri", "an", "jo", "na", "el", "sa", "li", "ha", "mo", "ra", "ke", "to", "bi", "su", "de", "ya", "fa",
+             "lu", "ne", "ar", "om", "is", "ul")
+CONDITIONS = (("Fever", 20), ("Flu", 20), ("Broken Arm", 8), ("Diabetes", 12), ("Asthma", 10), ("Chest Pain", 8),
+              ("Migraine", 8), ("Fracture", 6), ("Infection", 8))  # (condition, weight)
+SPECIALIZATIONS = ("Cardiologist", "Neurologist", "Pediatrician", "General Practitioner", "Orthopedist",
+                   "Emergency Medicine")
+ALLERGIES = ("Penicillin", "NSAIDs", "Sulfa Drugs", "Latex")
+START = datetime(2024, 4, 1)  # Simulated time starts at midnight on this day
+
+
+class Population:  # Defining a class for seeded synthetic patients and doctors
+    def __init__(self, rng):
+        # Initializing the Population with a seeded random generator
+        self.rng = rng
+        self.first_names = [self.word() for _ in range(2_000)]
+        self.last_names = [self.word() for _ in range(5_000)]
+        self.conditions = [condition for condition, _ in CONDITIONS]
+        self.weights = [weight for _, weight in CONDITIONS]
+        self.count = 0
+
+    def word(self):
+        return "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(2, 4))).capitalize()
+
+    def patient(self):
+        # Method to generate the fields of a new patient
+        rng = self.rng
+        self.count += 1
+        first, last = rng.choice(self.first_names), rng.choice(self.last_names)
+        return {"id": f"S{self.count:08d}", "name": f"{first} {last}", "age": rng.randint(0, 95),
+                "gender": rng.choice(("Male", "Female")), "address": f"{rng.randint(1, 999)} {self.word()} St",
+                "phone_number": f"555-{rng.randrange(1000):03d}-{rng.randrange(10_000):04d}",
+                "email": f"{first.lower()}.{last.lower()}{self.count % 100}@example.com",
+                "medical_condition": rng.choices(self.conditions, self.weights)[0],
+                "risk_level": rng.choices((1, 2, 3, 4, 5), (30, 30, 20, 12, 8))[0],
+                "height": f"{rng.randint(50, 200)} cm", "weight": f"{rng.randint(3, 130)} kg",
+                "allergies": [rng.choice(ALLERGIES)] if rng.random() < 0.15 else [],
+                "previous_surgeries": [], "vital_signs": {}}
+
+    def doctor(self, number):
+        # Method to generate the fields of a doctor
+        name = f"Dr. {self.rng.choice(self.last_names)}"
+        return {"id": f"D{number:05d}", "name": name, "specialization": SPECIALIZATIONS[number % len(SPECIALIZATIONS)],
+                "address": f"{number} Hospital Rd", "phone_number": f"555-{number:07d}",
+                "email": f"doctor{number}@example.com"}
+
+
+class Simulator:  # Defining a class for a seeded discrete-event simulation of an emergency room
+    # Arrivals, triage, booking, consultations, prescriptions, searches, dashboards and nightly jobs are events on a
+    # simulated clock; every event calls the public HospitalSystem API and the call is timed per operation type
+    def __init__(self, seed=1, patients=10_000, doctors=50, days=7, arrivals_per_hour=60.0, consultants=8,
+                 memory_every=50, storage=None):
+        # Initializing the Simulator
+        self.config = {"seed": seed, "patients": patients, "doctors": doctors, "days": days,
+                       "arrivals_per_hour": arrivals_per_hour, "consultants": consultants,
+                       "memory_every": memory_every}
+        self.rng = random.Random(seed)
+        self.population = Population(self.rng)
+        self.now = START.timestamp()  # Simulated clock, in seconds since the epoch
+        self.end = self.now + days * 86_400
+        self.events = []  # Heap of (time, sequence, event name, argument)
+        self.sequence = 0
+        self.memory_every = memory_every
+        self.latencies = {}  # Operation -> list of seconds
+        self.calls = {}  # Operation -> number of calls
+        self.peak_memory = {}  # Operation -> largest traced allocation peak in bytes
+        self.outcome = {"arrivals": 0, "triaged": 0, "booked": 0, "called": 0, "prescribed": 0, "dispensed": 0,
+                        "searches_found": 0, "searches": 0}
+        self.patient_ids = []  # All registered patients
+        self.system = hospital.HospitalSystem(storage, presenter=hospital.quiet_presenter(), sample_data=False,
+                                              clock=lambda: self.now)
+
+    def schedule(self, delay, event, argument=None):
+        # Method to schedule an event after delay simulated seconds
+        self.sequence += 1
+        heapq.heappush(self.events, (self.now + delay, self.sequence, event, argument))
+
+    def measure(self, operation, function, *args):
+        # Method to call one operation, recording its latency; every memory_every-th call of each operation (from the
+        # second) is run under tracemalloc instead, to record its peak allocation without slowing the timed calls
+        count = self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.memory_every and count % self.memory_every == 2 % self.memory_every:
+            tracemalloc.start()
+            result = function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.peak_memory[operation] = max(self.peak_memory.get(operation, 0), peak)
+            return result
+        start = time.perf_counter()
+        result = function(*args)
+        self.latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        return result
+
+    def setup(self):
+        # Method to load doctors, their schedules and the registered patient base
+        system = self.system
+        for number in range(self.config["doctors"]):
+            fields = self.population.doctor(number)
+            system.add_doctor(**fields)
+            for day in range(self.config["days"] + 1):  # 8 AM to 4 PM in 15-minute slots
+                system.add_schedule(fields["id"], (START + timedelta(days=day)).strftime("%Y-%m-%d"), "08:00 AM", 32)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "patients.jsonl")
+            records = [self.population.patient() for _ in range(self.config["patients"])]
+            hospital.write_patient_records(path, records)
+            self.measure("import_patients", system.import_patients, path, None, False)
+        self.patient_ids.extend(record["id"] for record in records)
+
+    def run(self):
+        # Method to run the simulation; returns the results
+        wall = time.perf_counter()
+        self.setup()
+        self.schedule(self.rng.expovariate(self.config["arrivals_per_hour"] / 3600), "arrival")
+        for _ in range(self.config["consultants"]):
+            self.schedule(self.rng.uniform(0, 600), "consult")
+        self.schedule(60, "search")
+        self.schedule(300, "dashboard")
+        self.schedule(2 * 3600, "ward_round")  # Nightly at 2 AM
+        self.schedule(6 * 3600, "census")  # Daily at 6 AM
+        events = 0
+        while self.events and self.events[0][0] < self.end:
+            self.now, _, event, argument = heapq.heappop(self.events)
+            getattr(self, event)(argument)
+            events += 1
+        wall = time.perf_counter() - wall
+        return self.results(events, wall)
+
+    def arrival(self, _):
+        fields = self.population.patient()
+        self.measure("add_patient", self.system.add_patient, *fields.values())
+        self.patient_ids.append(fields["id"])
+        self.outcome["arrivals"] += 1
+        self.schedule(self.rng.expovariate(1 / 300), "triage", fields["id"])
+        if self.rng.random() < 0.3:  # Some patients need a specialist appointment
+            self.schedule(self.rng.expovariate(1 / 900), "booking", fields["id"])
+        self.schedule(self.rng.expovariate(self.config["arrivals_per_hour"] / 3600), "arrival")
+
+    def triage(self, patient_id):
+        rng = self.rng
+        self.measure("record_vital_sign", self.system.record_vital_sign, patient_id, "Pulse Rate",
+                     f"{rng.randint(50, 140)} bpm")
+        if rng.random() < 0.3:  # The nurse re-assesses the risk level
+            self.measure("update_risk_level", self.system.update_risk_level, patient_id, rng.randint(1, 5))
+        self.outcome["triaged"] += 1
+
+    def booking(self, patient_id):
+        specialization = self.rng.choice(SPECIALIZATIONS)
+        slots = self.measure("find_earliest_slot", self.system.find_earliest_slot, specialization,
+                             datetime.fromtimestamp(self.now), 3)
+        if slots:
+            when, doctor = slots[0]
+            result = self.measure("book_appointment", self.system.book_appointment, patient_id, doctor.id,
+                                  when.strftime("%Y-%m-%d"), when.strftime("%I:%M %p"))
+            self.outcome["booked"] += bool(result)
+
+    def consult(self, _):
+        result = self.measure("call_next_patient", self.system.call_next_patient)
+        if not result:  # Nobody waiting: check again in a minute
+            self.schedule(60, "consult")
+            return
+        self.outcome["called"] += 1
+        if self.rng.random() < 0.4:
+            self.schedule(0, "prescribe", result.data.id)
+        self.schedule(self.rng.expovariate(1 / 900), "consult")  # 15 minutes per consultation on average
+
+    def prescribe(self, patient_id):
+        medication = self.rng.choice([medication.code for medication in self.system.pharmacy])
+        result = self.measure("purchase_prescription", self.system.purchase_prescription, patient_id, medication)
+        self.outcome["prescribed"] += bool(result)
+
+    def search(self, _):
+        patient_id = self.rng.choice(self.patient_ids)
+        name = list(self.system.search_patient(patient_id).name.lower())
+        i = self.rng.randrange(1, len(name) - 1)
+        name[i], name[i + 1] = name[i + 1], name[i]  # The front desk mistypes the name
+        result = self.measure("search_patients", self.system.search_patients, "".join(name))
+        self.outcome["searches"] += 1
+        self.outcome["searches_found"] += any(patient.id == patient_id for _, patient in result.data)
+        self.schedule(self.rng.expovariate(1 / 120), "search")
+
+    def dashboard(self, _):
+        self.measure("queue_statistics", self.system.queue_statistics)
+        self.schedule(300, "dashboard")
+
+    def ward_round(self, _):
+        rng = self.rng
+        for medication in self.system.pharmacy:  # The pharmacy is restocked before the round
+            self.measure("restock_medication", self.system.restock_medication, medication.code, 5_000)
+        codes = [medication.code for medication in self.system.pharmacy]
+        orders = [{"patient_id": rng.choice(self.patient_ids), "medication": rng.choice(codes)}
+                  for _ in range(min(20_000, len(self.patient_ids) // 2))]
+        result = self.measure("dispense_prescriptions", self.system.dispense_prescriptions, orders)
+        self.outcome["dispensed"] += result.data["dispensed"]
+        self.schedule(86_400, "ward_round")
+
+    def census(self, _):
+        self.measure("census_report", self.system.census_report)
+        self.schedule(86_400, "census")
+
+    def results(self, events, wall):
+        # Method to summarize the run as JSON-compatible data
+        operations = {}
+        for operation, count in sorted(self.calls.items()):
+            latencies = sorted(self.latencies.get(operation, ()))
+            peak = self.peak_memory.get(operation)
+            summary = {"calls": count, "peak_memory_kb": None if peak is None else round(peak / 1024, 1)}
+            if latencies:
+                total = sum(latencies)
+                summary.update({
+                    "throughput_per_s": round(len(latencies) / total, 1) if total else None,
+                    "mean_ms": round(total / len(latencies) * 1e3, 4),
+                    **{f"p{q}_ms": round(percentile(latencies, q) * 1e3, 4) for q in (50, 95, 99)},
+                    "max_ms": round(latencies[-1] * 1e3, 4)})
+            operations[operation] = summary
+        stats = self.system.queue_statistics()
+        self.outcome.update({"queue_depth": stats["depth"], "simulated_p95_wait_s": stats["p95_wait"]})
+        return {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                "platform": platform.platform(), "config": self.config, "events": events,
+                "wall_seconds": round(wall, 3), "events_per_s": round(events / wall, 1), "outcome": self.outcome,
+                "operations": operations}
+
+
+def percentile(values, q):
+    # Function to get the q-th percentile of sorted values (nearest rank)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def compare(baseline, current, tolerance=0.10, floor_ms=0.05):
+    # Function to compare two result files; returns the regressions as (operation, metric, before, after)
+    regressions = []
+    if baseline["config"] != current["config"] or baseline["events"] != current["events"]:
+        print("Warning: the runs used different workloads, so the numbers are not directly comparable.")
+    print(f"{'operation':>24} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'peak KB':>16}")
+    for operation in sorted(set(baseline["operations"]) & set(current["operations"])):
+        before, after = baseline["operations"][operation], current["operations"][operation]
+        cells = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "peak_memory_kb"):
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                cells.append(f"{'-':>16}")
+                continue
+            cells.append(f"{old:>7.3f} → {new:<7.3f}")
+            noise = floor_ms if metric.endswith("_ms") else 1.0
+            if new > old * (1 + tolerance) and new - old > noise:
+                regressions.append((operation, metric, old, new))
+        print(f"{operation:>24} " + " ".join(cells))
+    for operation, metric, old, new in regressions:
+        print(f"REGRESSION {operation} {metric}: {old} → {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    # Usage: python simulation.py run [options] [--out results.json]
+    #        python simulation.py compare baseline.json current.json [--tolerance 0.1]
+    parser = argparse.ArgumentParser(description="Emergency room simulation and benchmark harness")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run a seeded simulation and report per-operation performance")
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--patients", type=int, default=10_000, help="registered patients loaded before the run")
+    run.add_argument("--doctors", type=int, default=50)
+    run.add_argument("--days", type=int, default=7, help="simulated days")
+    run.add_argument("--arrivals-per-hour", type=float, default=60.0)
+    run.add_argument("--consultants", type=int, default=8, help="doctors seeing queued patients at once")
+    run.add_argument("--memory-every", type=int, default=50, help="trace memory on every n-th call (0: never)")
+    run.add_argument("--db", help="persist to this SQLite file instead of memory only")
+    run.add_argument("--out", help="write the results as JSON to this file")
+    check = commands.add_parser("compare", help="compare two result files and flag regressions")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown, e.g. 0.1 for 10%%")
+    args = parser.parse_args()
+    if args.command == "compare":
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+    storage = hospital.SQLiteStorage(args.db) if args.db else None
+    simulator = Simulator(args.seed, args.patients, args.doctors, args.days, args.arrivals_per_hour,
+                          args.consultants, args.memory_every, storage)
+    results = simulator.run()
+    simulator.system.close()
+    print(f"{results['events']} events in {results['wall_seconds']} s ({results['events_per_s']} events/s)")
+    print(f"outcome: {results['outcome']}")
+    print(f"{'operation':>24} {'calls':>8} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KB':>9}")
+    for operation, summary in results["operations"].items():
+        print(f"{operation:>24} {summary['calls']:>8} {summary.get('throughput_per_s') or 0:>10,.0f} "
+              f"{summary.get('p50_ms', 0):>9.3f} {summary.get('p95_ms', 0):>9.3f} {summary.get('p99_ms', 0):>9.3f} "
+              f"{summary['peak_memory_kb'] or 0:>9.1f}")
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.out}")